@@ -0,0 +1,116 @@
+#
+# Copyright: 2017 Red Hat, Inc.
+# Author: Nathaniel McCallum <npmccallum@redhat.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+from pytest import fixture
+import pkg_resources
+import configparser
+import whitfield
+import json
+import os
+
+BASELINE = os.path.join(os.path.dirname(__file__), "bench.json")
+SETUP = os.path.join(os.path.dirname(__file__), "..", "setup.cfg")
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("whitfield", "whitfield benchmarks")
+    group.addoption("--bench-baseline", metavar="PATH", default=BASELINE,
+                    help="baseline of the benchmarks (default: %(default)s)")
+    group.addoption("--bench-save", action="store_true",
+                    help="store the results in the baseline")
+    group.addoption("--bench-threshold", metavar="FRACTION", type=float,
+                    default=0.1, help="fail on regressions beyond this "
+                                      "fraction of the baseline (default: "
+                                      "%(default)s)")
+
+
+class Baseline:
+    """Compares benchmark results with the stored ones.
+
+    Each result is a dict of metrics, where lower is better. A metric fails
+    when it exceeds its baseline by more than the threshold. Metrics that
+    have no baseline pass.
+    """
+
+    def __init__(self, path, threshold):
+        self.path = path
+        self.threshold = threshold
+        self.results = {}
+
+        try:
+            with open(path) as f:
+                self.baseline = json.load(f)
+        except FileNotFoundError:
+            self.baseline = {}
+
+    def check(self, name, **metrics):
+        "Records the metrics of a benchmark. Returns the regressions."
+        self.results.setdefault(name, {}).update(metrics)
+
+        regressions = []
+        for key, value in metrics.items():
+            base = self.baseline.get(name, {}).get(key)
+            if base is not None and value > base * (1 + self.threshold):
+                regressions.append(f"{name}: {key} {value} > {base}")
+
+        return regressions
+
+    def save(self):
+        "Merges the results into the baseline file."
+        baseline = dict(self.baseline)
+        for name, metrics in self.results.items():
+            baseline[name] = dict(baseline.get(name, {}), **metrics)
+
+        with open(self.path, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+
+@fixture(scope="session")
+def baseline(request):
+    config = request.config
+    b = Baseline(config.getoption("bench_baseline"),
+                 config.getoption("bench_threshold"))
+    yield b
+
+    if config.getoption("bench_save") and b.results:
+        b.save()
+
+
+@fixture
+def plugins(monkeypatch):
+    """Serves the entry points declared in setup.cfg, in their order.
+
+    The tests then run against the tree, whether the package is installed
+    or not.
+    """
+    cfg = configparser.ConfigParser()
+    cfg.read(SETUP)
+    dist = pkg_resources.Distribution(project_name="whitfield",
+                                      version=str(whitfield.VERSION))
+
+    def iter_entry_points(group, name=None):
+        lines = cfg.get("entry_points", group).strip().splitlines()
+        eps = pkg_resources.EntryPoint.parse_group(group, lines, dist)
+        return iter(ep for n, ep in eps.items() if name in (None, n))
+
+    monkeypatch.setattr(pkg_resources, "iter_entry_points", iter_entry_points)
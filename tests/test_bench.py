@@ -0,0 +1,171 @@
+#
+# Copyright: 2017 Red Hat, Inc.
+# Author: Nathaniel McCallum <npmccallum@redhat.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""Benchmarks the generated code across primes and operations.
+
+Each case records the time per operation (ns/op, through the batch entry
+points, so that the cost of calling through ctypes is spread out) and the
+size of the IR for the function alone. Both are compared with the baseline
+in tests/bench.json; see conftest.py for the options.
+"""
+
+from whitfield.gen.llvm import LLVMGenerator
+from whitfield.math import ops
+from whitfield import util
+from pytest import fixture, mark
+
+import tempfile
+import ctypes
+import random
+import sys
+import os
+
+MODP2048 = int(
+    "ffffffffffffffffc90fdaa22168c234c4c6628b80dc1cd129024e088a67cc74"
+    "020bbea63b139b22514a08798e3404ddef9519b3cd3a431b302b0a6df25f1437"
+    "4fe1356d6d51c245e485b576625e7ec6f44c42e9a637ed6b0bff5cb6f406b7ed"
+    "ee386bfb5a899fa5ae9f24117c4b1fe649286651ece45b3dc2007cb8a163bf05"
+    "98da48361c55d39a69163fa8fd24cf5f83655d23dca3ad961c62f356208552bb"
+    "9ed529077096966d670c354e4abc9804f1746c08ca18217c32905e462e36ce3b"
+    "e39e772c180e86039b2783a2ec07a28fb5c55df06f4c52c9de2bcbf695581718"
+    "3995497cea956ae515d2261898fa051015728e5a8aacaa68ffffffffffffffff", 16)
+
+# The primes, with the generator options to build them with
+primes = {
+    "25519": (2 ** 255 - 19, {}),
+    "p256": (2 ** 256 - 2 ** 224 + 2 ** 192 + 2 ** 96 - 1, {}),
+    "p384": (2 ** 384 - 2 ** 128 - 2 ** 96 + 2 ** 32 - 1, {}),
+    "p521": (2 ** 521 - 1, {}),
+    "goldilocks": (2 ** 448 - 2 ** 224 - 1, {}),
+    "dh2048": (MODP2048, {"representation": "limbs", "unroll": False}),
+}
+
+functions = {
+    "add": [["v", ["l", "+", "r"]]],
+    "sub": [["v", ["l", "-", "r"]]],
+    "mul": [["v", ["l", "*", "r"]]],
+    "sqr": [["v", ["l", "*", "l"]]],
+    "exp": [["v", ["l", "@", "r"]]],
+    "fixed": [["v", [9, "@", "r"]]],  # Like a key generation
+    "div": [["v", ["l", "/", "r"]]],
+    "formula": [   # Like the doubling of a twisted Edwards point
+        ["a", ["l", "*", "l"]],
+        ["b", ["r", "*", "r"]],
+        ["c", [["l", "+", "r"], "*", ["l", "+", "r"]]],
+        ["e", [["c", "-", "a"], "-", "b"]],
+        ["g", ["b", "-", "a"]],
+        ["f", [["g", "-", "a"], "-", "b"]],
+        ["v", [["e", "*", "f"], "+", ["g", "*", "g"]]],
+    ],
+}
+
+N = 16  # Operations per batch
+
+
+def evaluate(limit, body, l, r):
+    "Evaluates a function body in Python."
+    op = ops(limit)
+    v = {"l": l, "r": r}
+
+    def expr(e):
+        if isinstance(e, int):
+            return e
+        if isinstance(e, str):
+            return v[e]
+        x, o, y = e
+        return op[o](expr(x), expr(y))
+
+    for name, e in body:
+        v[name] = expr(e)
+
+    return v["v"]
+
+
+def module(limit, *names):
+    "Returns the AST of a module with the named functions."
+    return {"name": "b", "limit": limit, "items": [{
+        "name": name,
+        "args": ["l", "r"],
+        "rets": ["v"],
+        "body": functions[name],
+    } for name in names]}
+
+
+@fixture(scope="module")
+def libraries():
+    "Builds each prime's library (with every function) once, on demand."
+    libs = {}
+
+    def library(prime):
+        if prime in libs:
+            return libs[prime]
+
+        limit, opts = primes[prime]
+        ast = module(limit, *functions)
+
+        d = tempfile.mkdtemp(prefix="whitfield")
+        src = os.path.join(d, f"{prime}.ll")
+        lib = os.path.join(d, f"lib{prime}.so")
+        with open(src, "w") as f:
+            for line in LLVMGenerator(batch=True, **opts)(ast):
+                f.write(line + os.linesep)
+
+        cmd = ("clang", "-O2", "-Wno-override-module", "-shared",
+               "-o", f'"{lib}"', f'"{src}"')
+        assert os.system(" ".join(cmd)) == 0
+
+        libs[prime] = ctypes.cdll.LoadLibrary(lib)
+        return libs[prime]
+
+    return library
+
+
+@mark.parametrize("function", functions)
+@mark.parametrize("prime", primes)
+def test_bench(benchmark, baseline, libraries, prime, function):
+    limit, opts = primes[prime]
+    body = functions[function]
+    size = util.bytes(limit)
+
+    rnd = random.Random(prime + function)
+    ls = [rnd.randrange(limit) for i in range(N)]
+    rs = [rnd.randrange(limit) for i in range(N)]
+    l = b"".join(x.to_bytes(size, sys.byteorder) for x in ls)
+    r = b"".join(x.to_bytes(size, sys.byteorder) for x in rs)
+    v = ctypes.create_string_buffer(size * N)
+
+    batch = getattr(libraries(prime), f"wht_b_{function}_batch")
+    benchmark(batch, ctypes.c_size_t(N), l, r, v)
+
+    for i, (x, y) in enumerate(zip(ls, rs)):
+        e = evaluate(limit, body, x, y).to_bytes(size, sys.byteorder)
+        assert v.raw[i * size:(i + 1) * size] == e
+
+    # The IR of the function alone, with the helpers it needs
+    ir = sum(1 for line in LLVMGenerator(**opts)(module(limit, function)))
+    metrics = {"ir": ir}
+    benchmark.extra_info["ir"] = ir
+    if benchmark.stats:
+        metrics["ns"] = round(benchmark.stats.stats.median * 1e9 / N, 1)
+        benchmark.extra_info["ns"] = metrics["ns"]
+
+    assert not baseline.check(f"{prime}-{function}", **metrics)
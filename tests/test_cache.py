@@ -0,0 +1,98 @@
+#
+# Copyright: 2017 Red Hat, Inc.
+# Author: Nathaniel McCallum <npmccallum@redhat.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+from whitfield.cache import Cache, sources
+import time
+import os
+
+
+def write(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def test_sources(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write("main.wht", "field 7; import foo; import bar;")
+    write("foo.wht", "import bar; x = 1;")
+    write("bar.wht", "import foo; y = 2;")
+
+    paths = [p for p, d in sources("main.wht")]
+    assert paths == [str(tmp_path / f"{n}.wht") for n in ("main", "foo", "bar")]
+    assert list(sources("baz.wht")) == [(str(tmp_path / "baz.wht"), None)]
+
+
+def test_sources_realpath(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "lib").mkdir()
+    os.symlink("lib", "alias")
+    write("lib/foo.wht", "x = 1;")
+    write("main.wht", "field 7; import lib/foo; import alias/foo;")
+
+    paths = [p for p, d in sources("main.wht")]
+    assert paths == [str(tmp_path / "main.wht"), str(tmp_path / "lib/foo.wht")]
+
+
+def test_cache_key(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write("main.wht", "field 7; import foo;")
+    write("foo.wht", "x = 1;")
+
+    cache = Cache(str(tmp_path / "cache"))
+    key = cache.key("main.wht", "opts")
+    assert cache.key("main.wht", "opts") == key
+    assert cache.key("main.wht", "other") != key
+
+    write("foo.wht", "x = 2;")
+    assert cache.key("main.wht", "opts") != key
+
+
+def test_cache(tmp_path):
+    cache = Cache(str(tmp_path))
+    assert cache.get("ab" * 32) is None
+
+    cache.put("ab" * 32, b"foo")
+    assert cache.get("ab" * 32) == b"foo"
+    assert cache.stats() == {"hits": 1, "misses": 1, "entries": 1, "size": 3}
+
+
+def test_cache_evict(tmp_path):
+    cache = Cache(str(tmp_path), size=8, age=60)
+
+    # The least recently used entries go first.
+    for i, key in enumerate(["aa", "bb", "cc"]):
+        cache.put(key * 32, b"1234")
+        t = time.time() - 10 + i
+        os.utime(cache._file(key * 32), (t, t))
+    assert cache.get("aa" * 32) is None
+    assert cache.get("bb" * 32) == b"1234"
+
+    cache.put("dd" * 32, b"1234")
+    assert cache.get("cc" * 32) is None
+    assert cache.get("bb" * 32) == b"1234"
+
+    # Entries unused for too long go, whatever the size.
+    t = time.time() - 120
+    os.utime(cache._file("bb" * 32), (t, t))
+    cache.evict()
+    assert cache.get("bb" * 32) is None
+    assert cache.stats()["entries"] == 1
@@ -23,6 +23,8 @@
 from whitfield.gen.header import HeaderGenerator
 from pytest import mark
 
+import subprocess
+
 ast = {
     "name": "foo",
     "limit": 2 ** 255 - 19,
@@ -37,12 +39,51 @@ typedef unsigned char wht_foo_t[32];
 extern wht_foo_t wht_foo_x;
 void wht_foo_bar(const wht_foo_t x, wht_foo_t y);"""
 
+batch = """#pragma once
+#include <stddef.h>
+typedef unsigned char wht_foo_t[32];
+extern wht_foo_t wht_foo_x;
+void wht_foo_bar(const wht_foo_t x, wht_foo_t y);
+void wht_foo_bar_batch(size_t wht_n, const wht_foo_t *x, wht_foo_t *y);
+void wht_foo_batch_inv(size_t wht_n, const wht_foo_t *x, wht_foo_t *r);"""
+
+profile = """#pragma once
+#include <stddef.h>
+#include <stdint.h>
+typedef unsigned char wht_foo_t[32];
+struct wht_foo_profile { const char *name; uint64_t calls; uint64_t cycles; };
+size_t wht_foo_profile(const struct wht_foo_profile **entries);
+void wht_foo_profile_reset(void);
+extern wht_foo_t wht_foo_x;
+void wht_foo_bar(const wht_foo_t x, wht_foo_t y);"""
+
+sqrt = out + """
+int wht_foo_sqrt(const wht_foo_t x, wht_foo_t r);"""
+
 
-@mark.parametrize("tst,exp", [
-    [ast, out],
+@mark.parametrize("tst,opts,exp", [
+    [ast, {}, out],
+    [ast, {"batch": True}, batch],
+    [ast, {"profile": True}, profile],
+    [ast, {"sqrt": True}, sqrt],
 ])
-def test_gen_header(tst, exp):
+def test_gen_header(tst, opts, exp):
     txt = ""
-    for chunk in HeaderGenerator()(ast):
+    for chunk in HeaderGenerator(**opts)(ast):
         txt += chunk + "\n"
     assert txt.strip() == exp
+
+
+def test_gen_header_compiles(tmp_path):
+    "The count of the batch functions does not clash with their arguments."
+    tst = {
+        "name": "foo",
+        "limit": 2 ** 255 - 19,
+        "items": [{"name": "bar", "args": ["n", "x"], "rets": ["r"]}],
+    }
+
+    src = tmp_path / "foo.h"
+    src.write_text("\n".join(HeaderGenerator(batch=True, sqrt=True)(tst)))
+    assert "size_t wht_n, const wht_foo_t *n" in src.read_text()
+    subprocess.run(("cc", "-fsyntax-only", "-x", "c", str(src)),
+                   check=True)
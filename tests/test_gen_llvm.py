@@ -20,14 +20,17 @@
 # under the License.
 #
 
+from whitfield.gen.header import HeaderGenerator
 from whitfield.gen.llvm import LLVMGenerator
 from whitfield.math import ops
 from whitfield import util
-from pytest import mark
+from pytest import mark, raises
 
+import contextlib
 import itertools
 import tempfile
 import ctypes
+import platform
 import math
 import sys
 import os
@@ -35,6 +38,34 @@ import os
 lim = 2 ** 255 - 19
 byt = util.bytes(lim)
 
+options = {
+    "serial": {"reduction": "serial"},
+    "montgomery": {"reduction": "montgomery"},
+    "solinas": {"reduction": "solinas"},
+    "limbs": {"representation": "limbs"},
+    "ladder": {"window": False},
+    "eager": {"lazy": False},
+    "loop": {"unroll": False},
+    "unroll": {"representation": "limbs", "window": False, "unroll": 3},
+    "serial-loop": {"reduction": "serial", "unroll": 4},
+    "noinline": {"inline": False},
+    "no-fixed": {"fixed": False},
+    "fixed": {"representation": "limbs", "fixed": 2, "unroll": 3},
+    "fermat": {"inversion": "fermat"},
+    "safegcd": {"representation": "limbs", "unroll": 5},
+}
+
+exprs = {
+    "+": ["l", "+", "r"],
+    "-": ["l", "-", "r"],
+    "*": ["l", "*", "r"],
+    "@": ["l", "@", "r"],
+    "sqr": ["l", "*", "l"],
+    "chain": [[[["l", "+", "r"], "+", "l"], "-", "r"], "-", ["r", "-", "l"]],
+    "fixed": [[3, "@", "r"], "*", [lim - 2, "@", "l"]],
+    "/": ["l", "/", "r"],
+}
+
 
 def seq():
     "Yields interesting numbers to test. These are near various boundaries."
@@ -53,14 +84,50 @@ def seq():
     yield lim - 1
 
 
+def expect(expr, l, r):
+    if isinstance(expr, int):
+        return expr
+    if isinstance(expr, str):
+        return {"l": l, "r": r}[expr]
+
+    x, o, y = expr
+    x, y = expect(x, l, r), expect(y, l, r)
+    if o == "/" and y == 0:
+        return 0  # As x * y @ (lim - 2)
+    return ops(lim)[o](x, y)
+
+
+@contextlib.contextmanager
+def library(ast, opts):
+    "Compiles the AST with the options and loads it."
+    with tempfile.NamedTemporaryFile(prefix="lib", suffix=".so") as lib:
+        with tempfile.NamedTemporaryFile(suffix=".ll") as src:
+            for chunk in LLVMGenerator(**opts)(ast):
+                src.write((chunk + os.linesep).encode("utf8"))
+            src.flush()
+
+            cmd = (
+                'clang',
+                '-Wno-override-module',
+                '-shared',
+                '-o',
+                f'"{lib.name}"',
+                f'"{src.name}"'
+            )
+            assert os.system(" ".join(cmd)) == 0
+
+        yield ctypes.cdll.LoadLibrary(lib.name)
+
+
 def run(func, runs):
     for l, r, v, e in runs:
         func(l, r, v)
         assert v == e
 
 
-@mark.parametrize("o", ["+", "-", "*", "@"])
-def test_gen_llvm(benchmark, o):
+@mark.parametrize("opts", options.values(), ids=list(options))
+@mark.parametrize("expr", exprs.values(), ids=list(exprs))
+def test_gen_llvm(benchmark, expr, opts):
     ast = {
         "name": "foo",
         "limit": lim,
@@ -68,31 +135,223 @@ def test_gen_llvm(benchmark, o):
             "name": "bar",
             "args": ["l", "r"],
             "rets": ["v"],
-            "body": [["v", ["l", o, "r"]]]
+            "body": [["v", expr]]
         }]
     }
 
     runs = [[l.to_bytes(byt, sys.byteorder),
              r.to_bytes(byt, sys.byteorder),
              bytes(byt),
-             ops(lim)[o](l, r).to_bytes(byt, sys.byteorder)]
+             expect(expr, l, r).to_bytes(byt, sys.byteorder)]
              for l, r in itertools.product(seq(), seq())]
 
-    with tempfile.NamedTemporaryFile(prefix="lib", suffix=".so") as lib:
-        with tempfile.NamedTemporaryFile(suffix=".ll") as src:
-            for chunk in LLVMGenerator()(ast):
-                src.write((chunk + os.linesep).encode("utf8"))
-            src.flush()
+    with library(ast, opts) as obj:
+        benchmark(run, obj.wht_foo_bar, runs)
 
-            cmd = (
-                'clang',
-                '-Wno-override-module',
-                '-shared',
-                '-o',
-                f'"{lib.name}"',
-                f'"{src.name}"'
-            )
-            assert os.system(" ".join(cmd)) == 0
 
-        obj = ctypes.cdll.LoadLibrary(lib.name)
-        benchmark(run, obj.wht_foo_bar, runs)
+@mark.parametrize("opts", options.values(), ids=list(options))
+def test_gen_llvm_batch(benchmark, opts):
+    expr = [["l", "*", "r"], "+", "l"]
+    ast = {
+        "name": "foo",
+        "limit": lim,
+        "items": [{
+            "name": "bar",
+            "args": ["l", "r"],
+            "rets": ["v"],
+            "body": [["v", expr]]
+        }]
+    }
+
+    pairs = list(itertools.product(seq(), seq()))
+    l = b"".join(l.to_bytes(byt, sys.byteorder) for l, r in pairs)
+    r = b"".join(r.to_bytes(byt, sys.byteorder) for l, r in pairs)
+    e = b"".join(expect(expr, l, r).to_bytes(byt, sys.byteorder)
+                 for l, r in pairs)
+
+    with library(ast, dict(opts, batch=True)) as obj:
+        v = ctypes.create_string_buffer(len(e) + 1)
+        obj.wht_foo_bar_batch(ctypes.c_size_t(0), l, r, v)
+        assert v.raw == bytes(len(e) + 1)
+
+        n = ctypes.c_size_t(len(pairs))
+        benchmark(obj.wht_foo_bar_batch, n, l, r, v)
+        assert v.raw == e + bytes(1)
+
+
+@mark.parametrize("opts", options.values(), ids=list(options))
+def test_gen_llvm_batch_inv(benchmark, opts):
+    ast = {"name": "foo", "limit": lim, "items": []}
+    xs = list(seq())
+    x = b"".join(x.to_bytes(byt, sys.byteorder) for x in xs)
+    e = b"".join((pow(x, lim - 2, lim)).to_bytes(byt, sys.byteorder)
+                 for x in xs)
+
+    with library(ast, dict(opts, batch=True)) as obj:
+        r = ctypes.create_string_buffer(len(e) + 1)
+        obj.wht_foo_batch_inv(ctypes.c_size_t(0), x, r)
+        assert r.raw == bytes(len(e) + 1)
+
+        obj.wht_foo_batch_inv(ctypes.c_size_t(1), x[byt:], r)
+        assert r.raw[:byt] == e[byt:2 * byt]
+
+        n = ctypes.c_size_t(len(xs))
+        benchmark(obj.wht_foo_batch_inv, n, x, r)
+        assert r.raw == e + bytes(1)
+
+
+def function(name, args=("l",)):
+    return {"name": name, "args": list(args), "rets": ["v"],
+            "body": [["v", [args[0], "*", args[0]]]]}
+
+
+@mark.parametrize("items,opts", [
+    [[function("batch_inv")], {"batch": True}],
+    [[function("f"), function("f_batch")], {"batch": True}],
+    [[function("sqrt")], {"sqrt": True}],
+    [[function("profile")], {"profile": True}],
+    [[["f", 1], function("f")], {}],
+    [[function("f", ["wht_n"])], {}],
+])
+def test_gen_llvm_symbols(items, opts):
+    "Generated symbols that would clash are rejected."
+    ast = {"name": "foo", "limit": lim, "items": items}
+    with raises(ValueError):
+        list(LLVMGenerator(**opts)(ast))
+    with raises(ValueError):
+        list(HeaderGenerator(**opts)(ast))
+
+    # Without the option, there is no clash.
+    if opts:
+        list(LLVMGenerator()(ast))
+
+
+A, N = "alwaysinline", "noinline"
+
+
+@mark.parametrize("expr,opts,exp", [
+    [["l", "+", "r"], {}, {}],
+    [["l", "+", "r"], {"lazy": False}, {"add": A}],
+    [["l", "*", "r"], {}, {"mul": A}],
+    [["l", "*", "l"], {}, {"sqr": A}],
+    [["l", "*", "l"], {"reduction": "serial"}, {"add": A, "mul": N, "sqr": A}],
+    [["l", "@", "r"], {}, {"mul": A, "sqr": A, "exp": N}],
+    [["l", "@", "r"], {"inline": True}, {"mul": A, "sqr": A, "exp": A}],
+    [["l", "*", "r"], {"inline": False}, {"mul": N}],
+    [["l", "-", "r"], {"reduction": "montgomery"}, {"mul": A}],
+    [["l", "-", "r"], {"lazy": False}, {"sub": A}],
+    [[3, "@", "r"], {}, {"mul": A, "exp.0": A}],
+    [[3, "@", "r"], {"fixed": False}, {"mul": A, "sqr": A, "exp": N}],
+    [["l", "/", "r"], {}, {"mul": A, "inv": N, "div": A}],
+    [["l", "/", "r"], {"inversion": "fermat"},
+     {"mul": A, "sqr": A, "exp": N, "inv": A, "div": A}],
+])
+def test_gen_llvm_helpers(expr, opts, exp):
+    "Checks that only the helpers used are emitted, with their hints."
+    ast = {
+        "name": "foo",
+        "limit": lim,
+        "items": [{
+            "name": "bar",
+            "args": ["l", "r"],
+            "rets": ["v"],
+            "body": [["v", expr]]
+        }]
+    }
+
+    lines = list(LLVMGenerator(**opts)(ast))
+    helpers = {}
+    for n, line in enumerate(lines):
+        if line.startswith("define internal fastcc "):
+            name = lines[n + 1].split("(")[0][1:]
+            helpers[name] = lines[n + 2].split()[-1]
+
+    assert helpers == exp
+
+
+class Profile(ctypes.Structure):
+    _fields_ = [
+        ("name", ctypes.c_char_p),
+        ("calls", ctypes.c_uint64),
+        ("cycles", ctypes.c_uint64),
+    ]
+
+
+@mark.parametrize("profile", [True, "cycles"])
+def test_gen_llvm_profile(profile):
+    ast = {
+        "name": "foo",
+        "limit": lim,
+        "items": [{
+            "name": "bar",
+            "args": ["l", "r"],
+            "rets": ["v"],
+            "body": [["x", ["l", "@", "r"]], ["v", ["x", "*", "l"]]]
+        }]
+    }
+
+    def counters(obj):
+        entries = ctypes.POINTER(Profile)()
+        n = obj.wht_foo_profile(ctypes.byref(entries))
+        return {entries[i].name.decode(): (entries[i].calls, entries[i].cycles)
+                for i in range(n)}
+
+    with library(ast, {"profile": profile}) as obj:
+        obj.wht_foo_profile.restype = ctypes.c_size_t
+        assert counters(obj) == {
+            "wht_foo_bar": (0, 0),
+            "mul": (0, 0),
+            "sqr": (0, 0),
+            "exp": (0, 0),
+        }
+
+        l = (3).to_bytes(byt, sys.byteorder)
+        r = (5).to_bytes(byt, sys.byteorder)
+        v = bytes(byt)
+        for i in range(3):
+            obj.wht_foo_bar(l, r, v)
+        assert v == (3 ** 6).to_bytes(byt, sys.byteorder)
+
+        c = counters(obj)
+        assert c["wht_foo_bar"][0] == 3
+        assert c["exp"][0] == 3
+        assert c["mul"][0] > 3    # Also used by exp
+        assert c["sqr"][0] > 3
+        if profile == "cycles":
+            assert c["wht_foo_bar"][1] >= c["exp"][1]
+            if platform.machine() in ("x86_64", "AMD64"):
+                assert c["exp"][1] > 0
+        else:
+            assert c["wht_foo_bar"][1] == 0
+
+        obj.wht_foo_profile_reset()
+        assert set(counters(obj).values()) == {(0, 0)}
+
+
+@mark.parametrize("limit", [
+    2 ** 255 - 19,               # 5 modulo 8: Atkin
+    2 ** 127 - 1,                # 3 modulo 4: one exponentiation
+    2 ** 224 - 2 ** 96 + 1,      # 1 modulo 2 ^ 96: Tonelli-Shanks
+    41,                          # 9 modulo 16: Tonelli-Shanks
+], ids=["atkin", "euler", "tonelli-shanks", "tonelli-shanks-small"])
+@mark.parametrize("opts", [{}, {"representation": "limbs", "unroll": 3}],
+                  ids=["wide", "limbs"])
+def test_gen_llvm_sqrt(limit, opts):
+    size = util.bytes(limit)
+    ast = {"name": "foo", "limit": limit, "items": []}
+
+    with library(ast, dict(opts, sqrt=True)) as obj:
+        for x in list(range(min(limit, 32))) + [limit - 2, limit - 1]:
+            r = ctypes.create_string_buffer(size)
+            ok = obj.wht_foo_sqrt(x.to_bytes(size, sys.byteorder), r)
+            r = int.from_bytes(r.raw, sys.byteorder)
+
+            square = x == 0 or pow(x, (limit - 1) // 2, limit) == 1
+            assert ok == square
+            assert r * r % limit == x if square else r == 0
+
+
+def test_gen_llvm_sqrt_even():
+    ast = {"name": "foo", "limit": 2 ** 128, "items": []}
+    with raises(ValueError):
+        list(LLVMGenerator(sqrt=True)(ast))
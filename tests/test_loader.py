@@ -0,0 +1,96 @@
+#
+# Copyright: 2017 Red Hat, Inc.
+# Author: Nathaniel McCallum <npmccallum@redhat.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+from whitfield.cache import Cache
+from whitfield import loader
+from pytest import raises
+import whitfield
+
+LIMIT = 2 ** 255 - 19
+
+SOURCE = """
+field 2 @ 255 - 19;
+gen = 9;
+
+mad(a, b, c)(d) {
+    d = a * b + c;
+}
+
+pair(a, b)(q, r) {
+    q = a @ b;
+    r = b - a;
+}
+"""
+
+
+def test_load(tmp_path, monkeypatch, plugins):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(loader, "_loaded", {})
+    (tmp_path / "grp.wht").write_text(SOURCE)
+    cache = str(tmp_path / "cache")
+
+    lib = whitfield.load("grp.wht", cache=cache)
+    assert lib._name == "grp"
+    assert lib._limit == LIMIT
+    assert lib.gen == 9
+    assert lib.mad(3, 4, 5) == 17
+    assert lib.mad(LIMIT - 1, 2, 0) == LIMIT - 2
+    assert lib.pair(3, 5) == (pow(3, 5, LIMIT), 2)
+
+    with raises(ValueError):
+        lib.mad(LIMIT, 1, 1)
+    with raises(TypeError):
+        lib.mad(1, 2)
+
+    # The library is loaded once per process, and built once.
+    assert whitfield.load("grp.wht", cache=cache) is lib
+    assert whitfield.load(SOURCE, "grp", cache=cache) is lib
+    monkeypatch.setattr(loader, "_loaded", {})
+    assert whitfield.load(SOURCE, "grp", cache=cache).mad(1, 2, 3) == 5
+    assert Cache(cache).stats()["hits"] == 1
+    assert Cache(cache).stats()["misses"] == 1
+
+    # Options and imports are part of the key.
+    whitfield.load("grp.wht", cache=cache, lazy=False)
+    assert Cache(cache).stats()["misses"] == 2
+
+    (tmp_path / "sq.wht").write_text("sq(a)(b) { b = a * a; }")
+    lib = whitfield.load(SOURCE + "import sq;", cache=cache)
+    assert lib._name == "wht"
+    assert lib.sq(3) == 9
+
+    (tmp_path / "sq.wht").write_text("sq(a)(b) { b = a * a * a; }")
+    lib = whitfield.load(SOURCE + "import sq;", cache=cache)
+    assert lib.sq(3) == 27
+    assert Cache(cache).stats()["misses"] == 4
+
+
+def test_load_names(tmp_path, monkeypatch, plugins):
+    "Constants named like the internals of a library do not replace them."
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(loader, "_loaded", {})
+    src = "field 2 @ 255 - 19;\nlimit = 5;\nname = 7;\nf(x)(y) { y = x + 1; }"
+
+    lib = whitfield.load(src, "names", cache=str(tmp_path / "cache"))
+    assert lib.limit == 5
+    assert lib.name == 7
+    assert lib.f(10 ** 20) == 10 ** 20 + 1
@@ -0,0 +1,102 @@
+#
+# Copyright: 2017 Red Hat, Inc.
+# Author: Nathaniel McCallum <npmccallum@redhat.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+from whitfield.__main__ import build, option, stale
+from whitfield.cache import Cache
+import os
+
+
+def test_option():
+    assert option("lazy") == ("lazy", True)
+    assert option("no-lazy") == ("lazy", False)
+    assert option("window=4") == ("window", 4)
+    assert option("reduction=serial") == ("reduction", "serial")
+
+
+def test_build(tmp_path, monkeypatch, plugins):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "mod.wht").write_text("field 251;\nx(a)(b) { b = a * a; }\n")
+
+    targets = [(ext, str(tmp_path / f"mod.{ext}")) for ext in ("ll", "h")]
+    build("mod.wht", targets, {"batch": True})
+
+    assert "@wht_mod_x(" in (tmp_path / "mod.ll").read_text()
+    assert "wht_mod_x_batch(" in (tmp_path / "mod.h").read_text()
+
+    # Outputs come from the cache the second time.
+    cache = (str(tmp_path / "cache"),)
+    build("mod.wht", targets, {}, cache)
+    build("mod.wht", targets, {}, cache)
+    assert Cache(*cache).stats()["hits"] == 2
+    assert Cache(*cache).stats()["misses"] == 2
+
+
+def test_build_modules(tmp_path, monkeypatch, plugins):
+    "The Importer caches modules in the given directory, not the default."
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("WHITFIELD_CACHE", raising=False)
+    (tmp_path / "sq.wht").write_text("sq(a)(b) { b = a * a; }\n")
+    (tmp_path / "mod.wht").write_text("field 251;\nimport sq;\n")
+
+    cache = (str(tmp_path / "cache"),)
+    build("mod.wht", [("h", str(tmp_path / "mod.h"))], {}, cache)
+    assert "WHITFIELD_CACHE" not in os.environ
+    assert Cache(str(tmp_path / "cache" / "modules")).stats()["entries"] == 1
+
+
+def test_build_time_passes(tmp_path, monkeypatch, capsys, plugins):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "mod.wht").write_text("field 251;\nx(a)(b) { b = a * 1; }\n")
+
+    build("mod.wht", [("h", str(tmp_path / "mod.h"))], {}, time_passes=True)
+    err = capsys.readouterr().err
+    assert err.startswith("whitfield: mod.wht: passes\n")
+    assert " Simplifier\n" in err
+    assert "  total\n" in err
+
+
+def test_build_depfile(tmp_path, monkeypatch, plugins):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "lib").mkdir()
+    (tmp_path / "lib" / "sq.wht").write_text("sq(a)(b) { b = a * a; }\n")
+    (tmp_path / "mid.wht").write_text("import lib/sq;\n")
+    (tmp_path / "mod.wht").write_text("field 251;\nimport mid;\n")
+
+    build("mod.wht", [("h", "my $.h")], {}, depfile="mod.d")
+    deps = [str(tmp_path / p) for p in ("mod.wht", "mid.wht", "lib/sq.wht")]
+    assert (tmp_path / "mod.d").read_text() == \
+        "my\\ $$.h: \\\n  " + " \\\n  ".join(deps) + "\n"
+
+
+def test_stale(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "sq.wht").write_text("sq(a)(b) { b = a * a; }\n")
+    (tmp_path / "mod.wht").write_text("field 251;\nimport sq;\n")
+    assert stale("mod.wht", ["mod.h"])
+
+    (tmp_path / "mod.h").write_text("")
+    os.utime("sq.wht", ns=(1, 1))
+    os.utime("mod.wht", ns=(1, 1))
+    assert not stale("mod.wht", ["mod.h"])
+
+    os.utime("sq.wht", ns=(2 ** 62, 2 ** 62))
+    assert stale("mod.wht", ["mod.h"])
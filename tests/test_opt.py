@@ -0,0 +1,123 @@
+#
+# Copyright: 2017 Red Hat, Inc.
+# Author: Nathaniel McCallum <npmccallum@redhat.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+from whitfield.opt import *
+from pytest import raises
+
+
+def optimizers():
+    "Returns new optimizers A, B and C, which append their names to a log."
+    def make(name):
+        def call(self, ast):
+            ast["log"].append(name)
+        return type(name, (Optimizer,), {"__call__": call})
+
+    return make("A"), make("B"), make("C")
+
+
+def names(manager):
+    return [[type(o).__name__ for o in opts] for r, opts in manager.passes]
+
+
+def test_schedule():
+    assert schedule([1, 2, 3], {}) == [1, 2, 3]
+    assert schedule([1, 2, 3], {3: {1}, 2: {1}}) == [2, 3, 1]
+    assert schedule([1, 2, 3, 4], {4: {2}, 1: {2}}) == [1, 3, 4, 2]
+
+
+def test_schedule_cycle():
+    with raises(ValueError, match="cycle: 2 -> 3 -> 2"):
+        schedule([1, 2, 3], {1: {2}, 2: {3}, 3: {2}})
+
+
+def test_pass_manager():
+    A, B, C = optimizers()
+    after(C)(A)
+    before(A)(B)
+    assert names(PassManager([A, B, C])) == [["B"], ["C"], ["A"]]
+
+
+def test_pass_manager_options():
+    class Opt(Optimizer):
+        options = ("cache",)
+
+        def __init__(self, cache=None):
+            self.cache = cache
+
+        def __call__(self, ast):
+            pass
+
+    A = optimizers()[0]
+    manager = PassManager([A, Opt], cache="dir", other=1)
+    assert [o.cache for r, opts in manager.passes for o in opts
+            if isinstance(o, Opt)] == ["dir"]
+
+
+def test_pass_manager_cycle():
+    A, B, C = optimizers()
+    after(B)(A)
+    after(C)(B)
+    after(A)(C)
+    with raises(ValueError, match="cycle"):
+        PassManager([A, B, C])
+
+
+def test_pass_manager_group():
+    A, B, C = optimizers()
+    group("g")(A)
+    group("g")(C)
+    after(A)(C)
+    after(B)(A)
+
+    ast = {"items": [], "log": []}
+    manager = PassManager([A, B, C], True)
+    assert names(manager) == [["B"], ["A", "C"]]
+
+    # The group runs once more, since the log always changes.
+    manager.limit = 3
+    manager(ast)
+    assert ast["log"] == ["B", "A", "C", "A", "C", "A", "C"]
+    assert [r[:2] for r in manager.records] == [
+        ("B", 1), ("A", 1), ("C", 1), ("A", 2), ("C", 2), ("A", 3), ("C", 3)
+    ]
+
+
+def test_pass_manager_fixed_point():
+    class Halve(Optimizer):
+        def __call__(self, ast):
+            ast["n"] //= 2
+
+    group("g")(Halve)
+    ast = {"items": [], "n": 8}
+    manager = PassManager([Halve], True)
+    manager(ast)
+    assert ast["n"] == 0
+    assert len(manager.records) == 5
+
+
+def test_size():
+    ast = {"items": ["x", ["a", 1], {"name": "f", "args": ["a"],
+                                      "rets": ["b"], "body": [
+        ["b", [["a", "*", "a"], "+", 1]],
+        ["c", "a"],
+    ]}]}
+    assert size(ast) == 2
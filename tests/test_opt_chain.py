@@ -0,0 +1,64 @@
+#
+# Copyright: 2017 Red Hat, Inc.
+# Author: Nathaniel McCallum <npmccallum@redhat.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+from whitfield.opt.chain import AdditionChain
+from whitfield.math import chain
+from whitfield import ast
+from pytest import mark
+
+LIMIT = 2 ** 255 - 19
+
+
+@mark.parametrize("exp", [2, 3, 5, 15, 16, 255, LIMIT - 2, (LIMIT + 3) // 8])
+def test_chain(exp):
+    e = [1]
+    for i, j in chain(exp):
+        e.append(e[i] + e[j])
+    assert e[-1] == exp
+
+
+def test_chain_runs():
+    # 254 squarings and 11 multiplications is the best known for inversion.
+    assert len(chain(LIMIT - 2)) <= 254 + 13
+
+
+@mark.parametrize("tst,exp", [
+    ["foo(x, y)(z) { z = x @ y; }",
+     [["z", ["x", "@", "y"]]]],
+    ["foo(x)(z) { z = x @ 0; }",
+     [["z", 1]]],
+    ["foo(x)(z) { z = x @ 1; }",
+     [["z", "x"]]],
+    ["foo(x)(z) { z = x @ 5; }",
+     [["_ac0", ["x", "*", "x"]],
+      ["_ac1", ["_ac0", "*", "_ac0"]],
+      ["z", ["_ac1", "*", "x"]]]],
+    ["foo(x, y)(z) { z = (x + y) @ 3 * y; }",
+     [["_ac0", ["x", "+", "y"]],
+      ["_ac1", ["_ac0", "*", "_ac0"]],
+      ["_ac2", ["_ac1", "*", "_ac0"]],
+      ["z", ["_ac2", "*", "y"]]]],
+])
+def test_addition_chain(tst, exp):
+    t = {"limit": LIMIT, "items": ast.BDY.parseString(tst).asList()[0]}
+    AdditionChain()(t)
+    assert t["items"][0]["body"] == exp
@@ -71,3 +71,60 @@ def test_function_condenser(tst, exp):
     e = {"limit": LIMIT, "items": ast.BDY.parseString(exp).asList()[0]}
     FunctionCondenser()(t)
     assert t == e
+
+
+@mark.parametrize("tst,exp", [
+    ["foo(x, y)(z) { z = x + y; }",         "foo(x, y)(z) { z = x + y; }"],
+    ["foo(x)(z) { z = x * 1; }",            "foo(x)(z) { z = x; }"],
+    ["foo(x)(z) { z = x + 0; }",            "foo(x)(z) { z = x; }"],
+    ["foo(x)(z) { z = x * 0; }",            "foo(x)(z) { z = 0; }"],
+    ["foo(x)(z) { z = x - x; }",            "foo(x)(z) { z = 0; }"],
+    ["foo(x)(z) { z = x @ 0; }",            "foo(x)(z) { z = 1; }"],
+    ["foo(x)(z) { z = x @ 1; }",            "foo(x)(z) { z = x; }"],
+    ["foo(x)(z) { z = x * 2; }",            "foo(x)(z) { z = x + x; }"],
+    ["foo(x, y)(z) { z = x + 3 + y + 4; }", "foo(x, y)(z) { z = x + y + 7; }"],
+    ["foo(x, y)(z) { z = x + y - x; }",     "foo(x, y)(z) { z = y; }"],
+    ["foo(x)(z) { z = x - 3 + 1; }",        "foo(x)(z) { z = x - 2; }"],
+    ["foo(x)(z) { z = 5 - x; }",            "foo(x)(z) { z = 5 - x; }"],
+    [f"foo(x)(z) {{ z = x * {LIMIT - 3}; }}",
+     "foo(x)(z) { z = 0 - (x + x + x); }"],
+    ["foo(x)(z) { z = x * 1000; }",         "foo(x)(z) { z = x * 1000; }"],
+    ["foo(x)(z) { z = (x @ 2) @ 3; }",      "foo(x)(z) { z = x @ 6; }"],
+    ["foo(x)(z) { z = x / 1; }",            "foo(x)(z) { z = x; }"],
+    ["foo(x)(z) { z = x / 2; }",
+     f"foo(x)(z) {{ z = x * {(LIMIT + 1) // 2}; }}"],
+    ["foo(x)(z) { z = 6 / 4; }",
+     f"foo(x)(z) {{ z = {(LIMIT + 3) // 2}; }}"],
+    ["foo(x)(z) { t = x - x; z = t + x; }", "foo(x)(z) { z = x; }"],
+    ["foo(x)(z) { z = x / 0; }",            "foo(x)(z) { z = 0; }"],
+    ["foo(x, y)(z) { z = x / (y - y); }",   "foo(x, y)(z) { z = 0; }"],
+    ["foo(x)(z) { z = 6 / (2 - 2); }",      "foo(x)(z) { z = 0; }"],
+])
+def test_simplifier(tst, exp):
+    t = {"limit": LIMIT, "items": ast.BDY.parseString(tst).asList()[0]}
+    e = {"limit": LIMIT, "items": ast.BDY.parseString(exp).asList()[0]}
+    Simplifier()(t)
+    assert t == e
+
+
+@mark.parametrize("tst,exp", [
+    ["foo(x)(z) { z = 3 * x * 2; }",
+     [["_m0", [["x", "+", "x"], "+", "x"]], ["z", ["_m0", "+", "_m0"]]]],
+    ["foo(x, y)(z) { z = x * y * 3; }",
+     [["_m0", ["x", "*", "y"]], ["z", [["_m0", "+", "_m0"], "+", "_m0"]]]],
+    ["foo(x, y)(z) { z = (x + y) * 4; }",
+     [["_m0", ["x", "+", "y"]], ["_m1", ["_m0", "+", "_m0"]],
+      ["z", ["_m1", "+", "_m1"]]]],
+    [[["_m0", "x"], ["z", [["x", "@", 3], "*", 2]]],
+     [["_m0", "x"], ["_m1", ["x", "@", 3]], ["z", ["_m1", "+", "_m1"]]]],
+])
+def test_simplifier_multiple(tst, exp):
+    "Compound operands of additions are assigned once, to new names."
+    if isinstance(tst, str):
+        items = ast.BDY.parseString(tst).asList()[0]
+    else:  # Names starting with _ cannot be parsed
+        items = [{"name": "foo", "args": ["x"], "rets": ["z"], "body": tst}]
+
+    t = {"limit": LIMIT, "items": items}
+    Simplifier()(t)
+    assert t["items"][0]["body"] == exp
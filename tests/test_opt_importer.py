@@ -21,6 +21,9 @@
 #
 
 from whitfield.opt.importer import Importer
+from whitfield.opt import importer
+from pytest import raises
+import os
 
 
 def test_importer():
@@ -38,3 +41,77 @@ def test_importer():
                      ['z', [['a', '+', 'c'], '+', 'A']]],
         }]
     }
+
+
+def write(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def test_importer_nested(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write("foo.wht", "import bar; import baz; x = 1;")
+    write("bar.wht", "import baz; import foo; y = 2;")
+    write("baz.wht", "z = 3;")
+
+    ast = {"items": ["foo", ["w", 0]]}
+    Importer()(ast)
+    assert ast["items"] == [["z", 3], ["y", 2], ["x", 1], ["w", 0]]
+
+
+def test_importer_memo(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write("foo.wht", "foo(a)(b) { b = a; }")
+
+    ast = {"items": ["foo"]}
+    Importer()(ast)
+    ast["items"][0]["body"] = []
+
+    # Parsed once, and unaffected by changes to earlier results
+    monkeypatch.setattr(importer, "parse_body", None)
+    ast = {"items": ["foo"]}
+    Importer()(ast)
+    assert ast["items"][0]["body"] == [["b", "a"]]
+
+    # Parsed again when it changes
+    monkeypatch.undo()
+    monkeypatch.chdir(tmp_path)
+    write("foo.wht", "foo(a)(b) { b = a + a; }")
+    os.utime("foo.wht", ns=(0, 0))
+    ast = {"items": ["foo"]}
+    Importer()(ast)
+    assert ast["items"][0]["body"] == [["b", ["a", "+", "a"]]]
+
+
+def test_importer_memo_bound(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    importer._parsed.cache_clear()
+    n = importer._parsed.cache_info().maxsize + 1
+    for i in range(n):
+        write(f"m{i}.wht", f"x{i} = {i};")
+
+    ast = {"items": [f"m{i}" for i in range(n)]}
+    Importer()(ast)
+    assert ast["items"][-1] == [f"x{n - 1}", n - 1]
+    assert importer._parsed.cache_info().currsize == n - 1
+
+
+def test_importer_cache(tmp_path, monkeypatch):
+    monkeypatch.delenv("WHITFIELD_CACHE", raising=False)
+    monkeypatch.chdir(tmp_path)
+    write("foo.wht", "x = 1;")
+
+    ast = {"items": ["foo"]}
+    Importer(str(tmp_path / "cache"))(ast)
+    assert ast["items"] == [["x", 1]]
+
+    # A new process would only have the persistent cache.
+    importer._parsed.cache_clear()
+    monkeypatch.setattr(importer, "parse_body", None)
+    ast = {"items": ["foo"]}
+    Importer(str(tmp_path / "cache"))(ast)
+    assert ast["items"] == [["x", 1]]
+
+    importer._parsed.cache_clear()
+    with raises(TypeError):
+        Importer()({"items": ["foo"]})
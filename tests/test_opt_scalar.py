@@ -0,0 +1,94 @@
+#
+# Copyright: 2017 Red Hat, Inc.
+# Author: Nathaniel McCallum <npmccallum@redhat.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+from whitfield.opt.scalar import *
+from whitfield import ast
+from pytest import mark
+
+LIMIT = 2 ** 255 - 19
+
+
+def body(src, *opts):
+    t = {"limit": LIMIT, "items": ast.BDY.parseString(src).asList()[0]}
+    for opt in opts:
+        opt()(t)
+    return t["items"][0]["body"]
+
+
+@mark.parametrize("tst,exp", [
+    ["foo(a)(x) { x = a @ 2; }",
+     [["x", ["a", "*", "a"]]]],
+    ["foo(a, b)(x) { x = (a + b) * (b + a); }",
+     [["_sq0", ["a", "+", "b"]], ["x", ["_sq0", "*", "_sq0"]]]],
+    ["foo(a, b)(x) { x = (a * b) @ 2 + a; }",
+     [["_sq0", ["a", "*", "b"]], ["x", [["_sq0", "*", "_sq0"], "+", "a"]]]],
+    ["foo(a, b)(x) { x = a * b; }",
+     [["x", ["a", "*", "b"]]]],
+])
+def test_squarer(tst, exp):
+    assert body(tst, Squarer) == exp
+
+
+@mark.parametrize("tst,exp", [
+    ["foo(a, b)(x, y) { x = a * b; y = a * b; }",
+     [["x", ["a", "*", "b"]], ["y", "x"]]],
+    ["foo(a, b)(x, y) { x = a * b; y = b * a; }",
+     [["x", ["a", "*", "b"]], ["y", "x"]]],
+    ["foo(a, b)(x, y) { x = a - b; y = b - a; }",
+     [["x", ["a", "-", "b"]], ["y", ["b", "-", "a"]]]],
+    ["foo(a, b, c, d)(x, y) { x = a * b + c; y = b * a + d; }",
+     [["_cse0", ["a", "*", "b"]],
+      ["x", ["_cse0", "+", "c"]],
+      ["y", ["_cse0", "+", "d"]]]],
+    ["foo(a, b)(x) { x = a * b; x = x + a * b; }",
+     [["_s0", ["a", "*", "b"]], ["x", ["_s0", "+", "_s0"]]]],
+])
+def test_cse(tst, exp):
+    assert body(tst, CommonSubexpressionEliminator) == exp
+
+
+@mark.parametrize("tst,exp", [
+    ["foo(a, b)(x) { t = a; x = t * b; }",
+     [["x", ["a", "*", "b"]]]],
+    ["foo(a, b)(x) { u = a * b; x = u; }",
+     [["x", ["a", "*", "b"]]]],
+    ["foo(a, b)(x, y) { u = a * b; x = u; y = u; }",
+     [["x", ["a", "*", "b"]], ["y", "x"]]],
+    ["foo(a)(x) { x = a; }",
+     [["x", "a"]]],
+])
+def test_copy_propagator(tst, exp):
+    assert body(tst, CopyPropagator) == exp
+
+
+@mark.parametrize("tst,exp", [
+    ["foo(a, b)(x) { t = a * b; x = a + b; }",
+     [["x", ["a", "+", "b"]]]],
+    ["foo(a, b)(x) { t = a * b; u = t * t; x = u + b; }",
+     [["t", ["a", "*", "b"]], ["u", ["t", "*", "t"]], ["x", ["u", "+", "b"]]]],
+    ["foo(a, b)(x) { x = a * b; x = x + b; }",
+     [["x", ["a", "*", "b"]], ["x", ["x", "+", "b"]]]],
+    ["foo(a, b)(x) { x = a * b; x = a + b; }",
+     [["x", ["a", "+", "b"]]]],
+])
+def test_dead_code_eliminator(tst, exp):
+    assert body(tst, DeadCodeEliminator) == exp
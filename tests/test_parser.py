@@ -0,0 +1,116 @@
+#
+# Copyright: 2017 Red Hat, Inc.
+# Author: Nathaniel McCallum <npmccallum@redhat.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+from whitfield.parser import Parser, ParseError, parse, parse_body
+from whitfield import ast
+from pytest import mark, raises
+import random
+
+parsers = {
+    "pyparsing": lambda text: ast.WHT.parseString(text, True).asList()[0],
+    "whitfield": parse,
+}
+
+
+def expression(rnd, depth, parens=True):
+    "Returns a random expression."
+    if depth == 0 or rnd.random() < 0.25:
+        return rnd.choice(["a", "b", "c", "17", "1 234", "0xab cd"])
+
+    l = expression(rnd, depth - 1, parens)
+    r = expression(rnd, depth - 1, parens)
+    e = f"{l} {rnd.choice('@*/+-')} {r}"
+    return f"({e})" if parens and rnd.random() < 0.2 else e
+
+
+def source(statements, seed=0):
+    "Returns a random source with the given number of statements."
+    rnd = random.Random(seed)
+    lines = ["field 2 @ 255 - 19;", "import dh;"]
+    lines += [f"k{i} = 0x{rnd.getrandbits(255):064x};"
+              for i in range(statements // 10)]
+
+    for f in range(statements // 10):
+        lines.append(f"f{f}(a, b)(c, d) {{")
+        lines += [f"    {rnd.choice('cd')} = {expression(rnd, 2, False)};"
+                  for i in range(9)]
+        lines.append("}")
+
+    return "\n".join(lines)
+
+
+@mark.parametrize("tst", [
+    "1 * b - 3 @ c / 5",
+    "1 @ b @ 3 * 2",
+    "a * b * c + d",
+    "a + b * c * d - e",
+    "(a + b) * (c - d) @ 2",
+    "0x1 234 + 12 345",
+])
+def test_expression(tst):
+    assert Parser(tst).expression() == ast.EXP.parseString(tst).asList()[0]
+
+
+def test_expression_random():
+    rnd = random.Random(0)
+    for i in range(500):
+        tst = expression(rnd, 3)
+        exp = ast.EXP.parseString(tst, True).asList()[0]
+        assert Parser(tst).expression() == exp
+
+
+@mark.parametrize("tst", [
+    "import foo;",
+    "import ../../foo/b4r; import foo-bar; import ./f00;",
+    "c = 7; a = 12;",
+    "import = 5;",
+    "foo(a, b)(c, d) { c = a; d = a + b - 7; }",
+])
+def test_body(tst):
+    assert parse_body(tst) == ast.BDY.parseString(tst, True).asList()[0]
+
+
+def test_file():
+    tst = source(100)
+    assert parse(tst) == ast.WHT.parseString(tst, True).asList()[0]
+
+
+@mark.parametrize("tst", [
+    "field 7;",
+    "field a; x = 1;",
+    "field 7; x = ;",
+    "field 7; x = 1",
+    "field 7; x = (1;",
+    "field 7; x = 1; $",
+    "field 7; f()(b) { b = 1; }",
+    "field 7; f(a)(b) {}",
+    "field 7; _x = 1;",
+])
+def test_error(tst):
+    with raises(ParseError):
+        parse(tst)
+
+
+@mark.parametrize("name", parsers)
+def test_parse_throughput(benchmark, name):
+    tst = source(2000)
+    benchmark.pedantic(parsers[name], (tst,), rounds=3)
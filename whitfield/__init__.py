@@ -21,3 +21,9 @@
 #
 
 VERSION = 1
+
+
+def load(*args, **kwargs):
+    "Compiles a module and loads it into this process. See loader.load()."
+    from .loader import load
+    return load(*args, **kwargs)
@@ -20,34 +20,233 @@
 # under the License.
 #
 
+from concurrent import futures
 import pkg_resources
+import argparse
 import sys
 import os
 
+from .cache import Cache, sources
+from .opt import PassManager
+from .parser import parse_file
 from . import ast
 
 
-def main():
-    name = os.path.basename(sys.argv[1]).split(".", 1)[0]
+def option(arg):
+    "Parses a generator option: NAME, no-NAME or NAME=VALUE."
+    key, sep, val = arg.partition("=")
+    key = key.replace("-", "_")
+
+    if sep:
+        return key, int(val) if val.isdigit() else val
+    if key.startswith("no_"):
+        return key[3:], False
+    return key, True
+
+
+def escape(path):
+    "Escapes a path for a Makefile."
+    return path.replace("$", "$$").replace("#", "\\#").replace(" ", "\\ ")
+
+
+def dependencies(src):
+    "Returns the paths of a source and of everything it imports."
+    return [path for path, data in sources(src)]
+
+
+def stale(src, outputs):
+    "Returns whether any output is missing or older than a dependency."
+    try:
+        deps = [os.stat(p).st_mtime_ns for p in dependencies(src)]
+        outs = [os.stat(p).st_mtime_ns for p in outputs]
+    except FileNotFoundError:
+        return True
+    return min(outs) < max(deps)
+
+
+def build(src, targets, options, cache=None, time_passes=False,
+          depfile=None):
+    """Compiles one source to each target, parsing and optimizing it once.
+
+    The targets are (extension, output path) pairs. Options are given to
+    each generator that knows them. If cache is given, it is the arguments
+    of a Cache; outputs found there are not generated again. If time_passes
+    is true, the time and effect of each optimizer is reported on stderr.
+    If depfile is given, a Makefile rule is written there, making each
+    target depend on the source and on all of its imports.
+    """
+    name = os.path.basename(src).split(".", 1)[0]
     assert ast.IDN.parseString(name)
 
-    src = ast.WHT.parseFile(sys.argv[1], True).asList()[0]
-    src["name"] = name
+    opts = pkg_resources.iter_entry_points(group="whitfield.opt.Optimizer")
+    gens = pkg_resources.iter_entry_points(group="whitfield.gen.Generator")
+    opts = list(opts)
+    gens = {ep.name: ep for ep in gens}
+
+    # The keys cover everything the outputs depend on.
+    modules = cache[0] if cache else None  # For the Importer
+    if cache:
+        cache = Cache(*cache)
+        plugins = sorted(str(ep) + f" ({ep.dist})" for ep in opts)
+
+    tree = None
+    for ext, dst in targets:
+        gen = gens[ext].load()
+        kwargs = {k: v for k, v in options.items() if k in gen.options}
+
+        out = None
+        if cache:
+            gen_plugin = str(gens[ext]) + f" ({gens[ext].dist})"
+            key = cache.key(src, name, plugins + [gen_plugin],
+                            sorted(kwargs.items()))
+            out = cache.get(key)
+
+        if out is None:
+            if tree is None:
+                tree = parse_file(src)
+                tree["name"] = name
 
-    dst = sys.argv[2]
-    ext = dst.rsplit('.', 1)[-1]
+                passes = PassManager([ep.load() for ep in opts], time_passes,
+                                     cache=modules)
+                passes(tree)
+                if time_passes:
+                    report = "".join(f"    {r}\n" for r in passes.report())
+                    print(f"whitfield: {src}: passes\n{report}", end="",
+                          file=sys.stderr)
 
-    eps = pkg_resources.iter_entry_points(group="whitfield.opt.Optimizer")
-    for opt in sorted([ep.load()() for ep in eps]):
-        opt(src)
+            out = "".join(txt + "\n" for txt in gen(**kwargs)(tree)).encode()
+            if cache:
+                cache.put(key, out)
+
+        with open(dst, "wb") as f:
+            f.write(out)
+
+    if depfile:
+        rule = " ".join(escape(dst) for ext, dst in targets) + ":"
+        rule += "".join(f" \\\n  {escape(p)}" for p in dependencies(src))
+        with open(depfile, "w") as f:
+            f.write(rule + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="whitfield",
+        usage="%(prog)s [-h] SRC DST | SRC... -t EXT [-t EXT...] [-o DIR]",
+        description="Compiles each source to each target. With just a "
+                    "source and an output file, the output's extension "
+                    "picks the target.")
+    parser.add_argument("files", nargs="+", metavar="FILE",
+                        help="source files (.wht), or a source and an output")
+    parser.add_argument("-t", dest="targets", metavar="EXT", default=[],
+                        action="append",
+                        help="target extension (picks the generator)")
+    parser.add_argument("-o", dest="outdir", metavar="DIR", default=".",
+                        help="output directory for targets (default: .)")
+    parser.add_argument("-j", dest="jobs", metavar="N", type=int,
+                        default=os.cpu_count() or 1,
+                        help="sources to compile in parallel (default: cores)")
+    parser.add_argument("-f", dest="options", metavar="OPTION", default=[],
+                        action="append", type=option,
+                        help="generator option (NAME, no-NAME, NAME=VALUE)")
+    parser.add_argument("--cache", metavar="DIR",
+                        default=os.environ.get("WHITFIELD_CACHE"),
+                        help="cache directory (default: $WHITFIELD_CACHE)")
+    parser.add_argument("--cache-size", metavar="BYTES", type=int,
+                        default=64 << 20, help="evict beyond this total size")
+    parser.add_argument("--cache-age", metavar="SECONDS", type=int,
+                        default=30 * 24 * 60 * 60,
+                        help="evict entries unused for this long")
+    parser.add_argument("--cache-stats", action="store_true",
+                        help="report cache statistics on stderr")
+    parser.add_argument("--time-passes", action="store_true",
+                        help="report the time and effect of each optimizer")
+    parser.add_argument("-MD", dest="depfile", action="store_true",
+                        help="write the dependencies of each source to a "
+                             "Makefile rule (next to the outputs, as .d)")
+    parser.add_argument("-MF", dest="depname", metavar="FILE",
+                        help="write the dependencies to FILE (implies -MD)")
+    parser.add_argument("--check", action="store_true",
+                        help="skip sources whose outputs are newer than "
+                             "the source and its imports")
+    args = parser.parse_args()
+
+    # Each source gets a list of (extension, output path) targets, and the
+    # path of its dependency file.
+    if not args.targets and len(args.files) == 2 \
+            and not args.files[1].endswith(".wht"):
+        src, dst = args.files
+        dep = os.path.splitext(dst)[0] + ".d"
+        jobs = [(src, [(dst.rsplit(".", 1)[-1], dst)], dep)]
+    elif args.targets:
+        jobs = []
+        for src in args.files:
+            name = os.path.basename(src).split(".", 1)[0]
+            dst = os.path.join(args.outdir, name)
+            jobs.append((src, [(ext, f"{dst}.{ext}") for ext in args.targets],
+                         f"{dst}.d"))
+    else:
+        parser.error("no targets given (-t EXT)")
+
+    if args.depname:
+        if len(jobs) > 1:
+            parser.error("-MF needs a single source")
+        jobs = [(src, targets, args.depname) for src, targets, dep in jobs]
+    elif not args.depfile:
+        jobs = [(src, targets, None) for src, targets, dep in jobs]
 
     eps = pkg_resources.iter_entry_points(group="whitfield.gen.Generator")
-    eps = {ep.name: ep for ep in eps}
-    gen = eps[ext].load()()
+    gens = {ep.name: ep.load() for ep in eps}
+    for src, targets, dep in jobs:
+        for ext, dst in targets:
+            if ext not in gens:
+                parser.error(f"unknown target '{ext}'")
+
+    # Options are shared by all generators; each takes the ones it knows.
+    options = dict(args.options)
+    for key in options:
+        if not any(key in g.options for g in gens.values()):
+            parser.error(f"unknown option '{key}'")
+
+    cache = None
+    if args.cache:
+        cache = (args.cache, args.cache_size, args.cache_age)
+
+    # Like make, skip the sources whose outputs are all up to date.
+    if args.check:
+        def outputs(targets, dep):
+            return [dst for ext, dst in targets] + ([dep] if dep else [])
+
+        jobs = [(src, targets, dep) for src, targets, dep in jobs
+                if stale(src, outputs(targets, dep))]
+        if not jobs:
+            return
+
+    # Sources are independent, so compile them in parallel.
+    workers = min(args.jobs, len(jobs))
+    if workers > 1:
+        pool = futures.ProcessPoolExecutor(workers)
+    else:
+        pool = futures.ThreadPoolExecutor(1)
+
+    failed = False
+    with pool:
+        running = {pool.submit(build, src, targets, options, cache,
+                               args.time_passes, dep): src
+                   for src, targets, dep in jobs}
+        for f in futures.as_completed(running):
+            try:
+                f.result()
+            except Exception as e:
+                print(f"whitfield: {running[f]}: {e}", file=sys.stderr)
+                failed = True
+
+    if cache and args.cache_stats:
+        stats = Cache(*cache).stats()
+        stats = " ".join(f"{k}={v}" for k, v in stats.items())
+        print(f"whitfield: cache {stats}", file=sys.stderr)
 
-    with open(dst, "w") as f:
-        for txt in gen(src):
-            print(txt, file=f)
+    if failed:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
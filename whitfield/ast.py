@@ -24,11 +24,19 @@ from pyparsing import *
 from string import hexdigits
 
 
+def exp_nest(x):
+    "Nests each flat chain of operations (a + b - c) into binary operations."
+    if isinstance(x, (int, str)):
+        return x
+
+    e = exp_nest(x[0])
+    for i in range(1, len(x), 2):
+        e = [e, x[i], exp_nest(x[i + 1])]
+    return e
+
+
 def exp_parse(x):
-    x = x[0]
-    while not isinstance(x, (int, str)) and len(x) > 3:
-        x = [x[:3]] + x[3:]
-    return [x]
+    return [exp_nest(x[0])]
 
 
 def fnc_parse(x):
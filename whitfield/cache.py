@@ -0,0 +1,180 @@
+#
+# Copyright: 2017 Red Hat, Inc.
+# Author: Nathaniel McCallum <npmccallum@redhat.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+from . import VERSION
+from . import ast
+import hashlib
+import fcntl
+import json
+import time
+import os
+
+
+def sources(path, seen=None):
+    """Yields the path and contents of a source file and of its imports.
+
+    Imports are found transitively and resolved like the Importer does, so
+    paths are yielded as real paths. A missing import has None contents.
+    """
+    seen = set() if seen is None else seen
+    path = os.path.realpath(path)
+    if path in seen:
+        return
+    seen.add(path)
+
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        yield path, None
+        return
+
+    yield path, data
+
+    text = data.decode("utf8", "replace")
+    for tokens, start, end in ast.IMP.scanString(text):
+        yield from sources(f"{tokens[0]}.wht", seen)
+
+
+class Cache:
+    """An on-disk cache of compiler outputs, keyed by a hash of the inputs.
+
+    Each output is stored in its own file, named by its key. Reading an
+    entry refreshes its modification time, so eviction (by age and then by
+    total size, oldest first) drops the least recently used entries. Hits
+    and misses are counted across runs in the stats file.
+    """
+
+    def __init__(self, path, size=64 << 20, age=30 * 24 * 60 * 60):
+        self.path = path
+        self.size = size
+        self.age = age
+
+    def key(self, src, *inputs):
+        """Returns the key for a source file compiled with the given inputs.
+
+        The source file may be None, when the source is given as an input.
+        """
+        h = hashlib.sha256()
+
+        def update(value):
+            data = value if isinstance(value, bytes) else repr(value).encode()
+            h.update(len(data).to_bytes(8, "little"))
+            h.update(data)
+
+        update(VERSION)
+        for path, data in sources(src) if src is not None else ():
+            update(path)
+            update(data)
+        for i in inputs:
+            update(i)
+
+        return h.hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, "objects", key[:2], key[2:])
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _counters(self):
+        try:
+            with open(os.path.join(self.path, "stats.json")) as f:
+                counters = json.load(f)
+        except (FileNotFoundError, ValueError):
+            counters = {}
+
+        return {k: counters.get(k, 0) for k in ("hits", "misses")}
+
+    def _count(self, name):
+        # Parallel builds share the counters, so update them under a lock.
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, "stats.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            counters = self._counters()
+            counters[name] += 1
+
+            data = json.dumps(counters).encode()
+            self._write(os.path.join(self.path, "stats.json"), data)
+
+    def _entries(self):
+        "Returns (mtime, size, path) for every entry."
+        entries = []
+        for root, dirs, files in os.walk(os.path.join(self.path, "objects")):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def get(self, key):
+        "Returns the output stored for key, or None if there is none."
+        path = self._file(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+
+        self._count("hits")
+        return data
+
+    def put(self, key, data):
+        "Stores the output for key, then evicts entries over the limits."
+        self._write(self._file(key), data)
+        self.evict()
+
+    def evict(self):
+        "Removes entries older than the age limit or beyond the size limit."
+        now = time.time()
+        total = 0
+
+        for mtime, size, path in sorted(self._entries(), reverse=True):
+            if now - mtime <= self.age and total + size <= self.size:
+                total += size
+                continue
+
+            try:
+                os.remove(path)
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+
+    def stats(self):
+        "Returns the hits, misses, entries and total size of the cache."
+        stats = self._counters()
+        entries = self._entries()
+        stats["entries"] = len(entries)
+        stats["size"] = sum(size for mtime, size, path in entries)
+        return stats
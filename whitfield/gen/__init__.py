@@ -24,6 +24,55 @@ import abc
 
 
 class Generator(abc.ABC):
+    "Generator options and their defaults. Override with keyword arguments."
+    options = {}
+
+    def __init__(self, **options):
+        for k, v in options.items():
+            if k not in self.options:
+                raise TypeError(f"Unknown option '{k}'!")
+
+        for k, v in dict(self.options, **options).items():
+            setattr(self, k, v)
+
     @abc.abstractmethod
     def __call__(self, ast):
         "Generates output from the AST. Yields lines."
+
+
+def symbols(ast, batch=False, sqrt=False, profile=False):
+    """Returns the C symbols of a module, with the generator options given.
+
+    Raises ValueError if two are the same, like the batch variant of f and
+    a function named f_batch. Argument and return names starting with wht_
+    are rejected too, as that prefix is left to the generated parameters.
+    """
+    name = ast["name"]
+    syms = []
+    for i in ast["items"]:
+        if isinstance(i, list):
+            syms.append(f"wht_{name}_{i[0]}")
+        elif isinstance(i, dict):
+            syms.append(f"wht_{name}_{i['name']}")
+            if batch:
+                syms.append(f"wht_{name}_{i['name']}_batch")
+
+            for x in i["args"] + i["rets"]:
+                if x.startswith("wht_"):
+                    raise ValueError(f"Name '{x}' is reserved!")
+
+    if batch and ast["limit"] % 2:
+        syms.append(f"wht_{name}_batch_inv")
+    if sqrt:
+        syms.append(f"wht_{name}_sqrt")
+    if profile:
+        syms += [f"wht_{name}_profile", f"wht_{name}_profile_reset",
+                 f"wht_{name}_profile_data"]
+
+    seen = set()
+    for s in syms:
+        if s in seen:
+            raise ValueError(f"Symbol '{s}' is defined twice!")
+        seen.add(s)
+
+    return syms
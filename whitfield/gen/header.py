@@ -20,20 +20,39 @@
 # under the License.
 #
 
-from . import Generator
+from . import Generator, symbols
 from .. import util
 from itertools import chain
 
 
 class HeaderGenerator(Generator):
+    options = {
+        "batch": False,
+        "profile": False,
+        "sqrt": False,
+    }
+
     def __call__(self, ast):
         bytes = util.bytes(ast['limit'])
         name = ast["name"]
+        symbols(ast, self.batch, self.sqrt, self.profile)
 
         yield f"#pragma once"
+        if self.batch or self.profile:
+            yield f"#include <stddef.h>"
+        if self.profile:
+            yield f"#include <stdint.h>"
 
         yield f"typedef unsigned char wht_{name}_t[{bytes}];"
 
+        # Calls (and cycles, if counted) of each function and helper
+        if self.profile:
+            yield f"struct wht_{name}_profile {{ const char *name; " \
+                  f"uint64_t calls; uint64_t cycles; }};"
+            yield f"size_t wht_{name}_profile(" \
+                  f"const struct wht_{name}_profile **entries);"
+            yield f"void wht_{name}_profile_reset(void);"
+
         for i in sorted(ast["items"], key=lambda x: isinstance(x, dict)):
             if isinstance(i, list):
                 yield f"extern wht_{name}_t wht_{name}_{i[0]};"
@@ -45,7 +64,23 @@ class HeaderGenerator(Generator):
                 prms = ", ".join(chain(args, rets))
                 yield f"void wht_{name}_{i['name']}({prms});"
 
+                if self.batch:
+                    args = [f"const wht_{name}_t *{x}" for x in i["args"]]
+                    rets = [f"wht_{name}_t *{x}" for x in i["rets"]]
+                    # Arguments cannot start with wht_, so the count is free.
+                    prms = ", ".join(chain(["size_t wht_n"], args, rets))
+                    yield f"void wht_{name}_{i['name']}_batch({prms});"
+
             else:
                 raise TypeError("Unknown item in AST!")
 
+        # Inverts n elements at the cost of one inversion (see the LLVM)
+        if self.batch and ast["limit"] % 2:
+            yield f"void wht_{name}_batch_inv(size_t wht_n, " \
+                  f"const wht_{name}_t *x, wht_{name}_t *r);"
+
+        # Returns 1, storing the root, or 0 if x has none
+        if self.sqrt:
+            yield f"int wht_{name}_sqrt(const wht_{name}_t x, wht_{name}_t r);"
+
         yield f""
@@ -20,14 +20,39 @@
 # under the License.
 #
 
-from . import Generator
+from . import Generator, symbols
 from .. import util
+from ..math import inverse, naf, nonresidue
+import itertools
 import abc
+import re
+
+CALL = re.compile(r"\bcall [^@]*@([\w.]+)\(")
+PROFILE = "%wht.profile"
+
+
+def cast(src, dst):
+    "Returns the instruction converting an i{src} to an i{dst}."
+    if src > dst:
+        return "trunc"
+    if src < dst:
+        return "zext"
+    return "bitcast"
 
 
 class Function(abc.ABC):
+    """Base for the helper functions called by the generated code.
+
+    Helpers are internal, so they use the fast calling convention. They
+    only compute on their arguments: they never unwind and never access
+    memory the caller can see.
+    """
+
     name = None
     op = None
+    args = 2
+    cc = "fastcc"
+    attributes = ("nounwind", "readnone")
 
     @classmethod
     def find_class(cls, op):
@@ -40,17 +65,224 @@ class Function(abc.ABC):
     def body(self):
         pass
 
-    def __call__(self):
-        yield f"define internal i{self.bits}"
-        yield f"@{self.name}(i{self.bits}, i{self.bits})"
+    def __call__(self, policy=None):
+        """Emits the function.
+
+        The policy, if given, is called with the function and its body. It
+        returns the attributes to use, rather than self.attributes.
+        """
+        body = list(self.body())
+        attrs = list(self.attributes)
+        if policy is not None:
+            attrs = policy(self, body)
+
+        yield f"define internal {self.cc} {self.type}"
+        yield f"@{self.name}({', '.join([self.type] * self.args)})"
+        yield f"{' '.join(attrs)}"
         yield f"{{"
-        yield from self.body()
+        yield from body
         yield f"}}"
 
-    def __init__(self, limit):
+    def call(self, name, *args):
+        "Returns a call of the helper name, of our type, with the args."
+        args = ", ".join(f"{self.type} {a}" for a in args)
+        return f"call {self.cc} {self.type} @{name}({args})"
+
+    def __init__(self, limit, limbs=False, unroll=True):
         self.limit = limit
         self.bits = util.bits(limit)
 
+        # Values are either one wide integer or an array of 64-bit limbs.
+        self.limbs = -(-limit.bit_length() // 64) if limbs else 0
+        self.type = f"[{self.limbs} x i64]" if limbs else f"i{self.bits}"
+
+        # Loops over bits are either fully unrolled (True) or emitted as
+        # loops doing that many steps per iteration (False is one).
+        if unroll is False:
+            unroll = 1
+        if unroll is not True:
+            if type(unroll) is not int or unroll < 1:
+                raise ValueError(f"Invalid unroll '{unroll}'!")
+        self.unroll = unroll
+
+    def const(self, value):
+        "Formats a compile-time integer as a constant of our type."
+        if not self.limbs:
+            return f"{value}"
+
+        words = (value >> 64 * i & (1 << 64) - 1 for i in range(self.limbs))
+        return "[" + ", ".join(f"i64 {w}" for w in words) + "]"
+
+    def repeat(self, steps, state, step, types=None, prefix=""):
+        """Emits steps calls of step(tag, i, state), for i from steps - 1 to 0.
+
+        Each step returns the new state, a list of values of our type (or of
+        the given types). The tag names its registers. Fully unrolled, i is
+        an integer. Otherwise the steps run in a loop, self.unroll per
+        iteration, and i is an i32 register; leftover steps are unrolled
+        before the loop. The loop's registers and labels start with the
+        prefix, so a function can have several. Returns the final state.
+        """
+        types = types or [self.type] * len(state)
+        n = self.unroll
+        p = prefix
+        loop = 0 if n is True else steps - steps % n
+
+        for i in range(steps - 1, loop - 1, -1):
+            state = yield from step(f"{i}", i, state)
+        if not loop:
+            return state
+
+        # The loop body's results are only known once it is emitted, but
+        # the phi nodes at its top need them.
+        body = []
+        new = [f"%{p}.v{j}" for j in range(len(state))]
+        for u in range(n):
+            body.append(f"%{p}.i{u} = sub i32 %{p}.i, {u + 1}")
+            new = yield from self.collect(body,
+                                          step(f"l{u}", f"%{p}.i{u}", new))
+
+        yield f"br label %{p}.head"
+        yield f"{p}.head:"
+        yield f"br label %{p}.loop"
+        yield f"{p}.loop:"
+        yield f"%{p}.i = phi i32 [ {loop}, %{p}.head ], [ %{p}.n, %{p}.loop ]"
+        for j, (t, x, y) in enumerate(zip(types, state, new)):
+            yield f"%{p}.v{j} = phi {t} [ {x}, %{p}.head ], [ {y}, %{p}.loop ]"
+        yield from body
+        yield f"%{p}.n = sub i32 %{p}.i, {n}"
+        yield f"%{p}.more = icmp ne i32 %{p}.n, 0"
+        yield f"br i1 %{p}.more, label %{p}.loop, label %{p}.done"
+        yield f"{p}.done:"
+        return new
+
+    @staticmethod
+    def collect(lines, instructions):
+        "Appends the lines of a generator to a list. Returns its value."
+        while True:
+            try:
+                lines.append(next(instructions))
+            except StopIteration as e:
+                return e.value
+        yield
+
+    def spill(self, dst, value):
+        """Emits a copy of value in memory, one limb past its end being zero.
+
+        This allows digit() and bit() at runtime offsets, which cannot use
+        extractvalue. The copy is dst, of type [n + 1 x i64]. Wide values
+        are shifted instead; they are returned as is.
+        """
+        if not self.limbs:
+            return value
+
+        a = f"[{self.limbs + 1} x i64]"
+        yield f"{dst} = alloca {a}"
+        for i in range(self.limbs + 1):
+            yield f"{dst}.p{i} = getelementptr {a}, {a}* {dst}, i32 0, i32 {i}"
+            if i < self.limbs:
+                yield f"{dst}.w{i} = extractvalue {self.type} {value}, {i}"
+                yield f"store i64 {dst}.w{i}, i64* {dst}.p{i}"
+            else:
+                yield f"store i64 0, i64* {dst}.p{i}"
+        return dst
+
+    def digit(self, dst, value, o, width):
+        """Emits dst = bits [o, o + width) of value as i32.
+
+        The offset o is an integer or an i32 register. For a register, the
+        value must have been given to spill().
+        """
+        mask = (1 << width) - 1
+
+        if not isinstance(o, int):
+            yield from self.shift(dst, value, o, width)
+            yield f"{dst} = and i32 {dst}.t, {mask}"
+            return
+
+        if not self.limbs:
+            b = self.bits
+            yield f"{dst}.s = lshr i{b} {value}, {o}"
+            yield f"{dst}.t = {cast(b, 32)} i{b} {dst}.s to i32"
+            yield f"{dst} = and i32 {dst}.t, {mask}"
+            return
+
+        yield f"{dst}.w = extractvalue {self.type} {value}, {o // 64}"
+        yield f"{dst}.s = lshr i64 {dst}.w, {o % 64}"
+        if o % 64 + width > 64 and o // 64 + 1 < self.limbs:
+            yield f"{dst}.v = extractvalue {self.type} {value}, {o // 64 + 1}"
+            yield f"{dst}.u = shl i64 {dst}.v, {64 - o % 64}"
+            yield f"{dst}.o = or i64 {dst}.s, {dst}.u"
+            yield f"{dst}.t = trunc i64 {dst}.o to i32"
+        else:
+            yield f"{dst}.t = trunc i64 {dst}.s to i32"
+        yield f"{dst} = and i32 {dst}.t, {mask}"
+
+    def shift(self, dst, value, o, width):
+        "Emits {dst}.t = value >> o as i32, for a register o (see digit())."
+        b = self.bits
+
+        if not self.limbs:
+            yield f"{dst}.c = {cast(32, b)} i32 {o} to i{b}"
+            yield f"{dst}.s = lshr i{b} {value}, {dst}.c"
+            yield f"{dst}.t = {cast(b, 32)} i{b} {dst}.s to i32"
+            return
+
+        # Read the limb holding bit o and, if the digit may straddle limbs,
+        # the next one. This splits o into limb q and shift r: the shift of
+        # the next limb is then 64 - r, done in two parts for r = 0.
+        a = f"[{self.limbs + 1} x i64]"
+        yield f"{dst}.q = lshr i32 {o}, 6"
+        yield f"{dst}.r = and i32 {o}, 63"
+        yield f"{dst}.p = getelementptr {a}, {a}* {value}, i32 0, i32 {dst}.q"
+        yield f"{dst}.w = load i64, i64* {dst}.p"
+        yield f"{dst}.k = zext i32 {dst}.r to i64"
+        yield f"{dst}.s = lshr i64 {dst}.w, {dst}.k"
+        if width == 1:
+            yield f"{dst}.t = trunc i64 {dst}.s to i32"
+            return
+
+        yield f"{dst}.i = add i32 {dst}.q, 1"
+        yield f"{dst}.n = getelementptr {a}, {a}* {value}, i32 0, i32 {dst}.i"
+        yield f"{dst}.v = load i64, i64* {dst}.n"
+        yield f"{dst}.j = sub i64 63, {dst}.k"
+        yield f"{dst}.l = shl i64 {dst}.v, 1"
+        yield f"{dst}.u = shl i64 {dst}.l, {dst}.j"
+        yield f"{dst}.o = or i64 {dst}.s, {dst}.u"
+        yield f"{dst}.t = trunc i64 {dst}.o to i32"
+
+    def mask(self, dst, cond, value, acc):
+        "Emits dst = acc | (cond ? value : 0), without branches or selects."
+        if not self.limbs:
+            yield f"{dst}.m = sext i1 {cond} to i{self.bits}"
+            yield f"{dst}.a = and i{self.bits} {value}, {dst}.m"
+            yield f"{dst} = or i{self.bits} {acc}, {dst}.a"
+            return
+
+        yield f"{dst}.m = sext i1 {cond} to i64"
+        prev = "undef"
+        for i in range(self.limbs):
+            n = f"{dst}" if i == self.limbs - 1 else f"{dst}.{i}"
+            yield f"{dst}.x{i} = extractvalue {self.type} {value}, {i}"
+            yield f"{dst}.y{i} = extractvalue {self.type} {acc}, {i}"
+            yield f"{dst}.a{i} = and i64 {dst}.x{i}, {dst}.m"
+            yield f"{dst}.o{i} = or i64 {dst}.y{i}, {dst}.a{i}"
+            yield f"{n} = insertvalue {self.type} {prev}, i64 {dst}.o{i}, {i}"
+            prev = n
+
+    def bit(self, dst, value, o):
+        "Emits dst = (bit o of value is set) as i1. See digit() for o."
+        if not isinstance(o, int):
+            yield from self.shift(dst, value, o, 1)
+            yield f"{dst} = trunc i32 {dst}.t to i1"
+        elif not self.limbs:
+            yield f"{dst}.b = and i{self.bits} {value}, {1 << o}"
+            yield f"{dst} = icmp ne i{self.bits} {dst}.b, 0"
+        else:
+            yield f"{dst}.w = extractvalue {self.type} {value}, {o // 64}"
+            yield f"{dst}.b = and i64 {dst}.w, {1 << o % 64}"
+            yield f"{dst} = icmp ne i64 {dst}.b, 0"
+
 
 class AddFunction(Function):
     name = "add"
@@ -77,57 +309,1236 @@ class SubFunction(Function):
 
 
 class MulFunction(Function):
+    "Base for multiplications, which differ in how they reduce."
+
     name = "mul"
     op = "*"
+    reduction = None
+
+    @classmethod
+    def find_reduction(cls, reduction):
+        todo = cls.__subclasses__()
+        while todo:
+            c = todo.pop(0)
+            if c.reduction == reduction:
+                return c
+            todo += c.__subclasses__()
+        raise ValueError(f"Unknown reduction '{reduction}'!")
+
+    def encode(self, value):
+        "Converts a compile-time integer into the multiplication domain."
+        return value
+
+    def enter(self, value):
+        "Emits the conversion of a runtime value into the domain."
+        return value
+        yield
+
+    def leave(self, value):
+        "Emits the conversion of a runtime value out of the domain."
+        return value
+        yield
+
+    @abc.abstractmethod
+    def square(self):
+        "Emits the body of sqr, which squares its only argument."
+
+
+class WideMulFunction(MulFunction):
+    """Base for multiplications that reduce a double width product.
+
+    The body multiplies at double width into %5 and reduces that; square
+    does the same into %2. Subclasses provide reduce().
+    """
 
     def body(self):
         bits = self.bits
+        wide = bits * 2
 
-        yield f"%3 = add i{bits} %0, 0"
-        yield f"%4 = add i{bits} 0, 0"
+        yield f"%3 = zext i{bits} %0 to i{wide}"
+        yield f"%4 = zext i{bits} %1 to i{wide}"
+        yield f"%5 = mul i{wide} %3, %4"
+        yield from self.reduce(5)
+
+    def square(self):
+        bits = self.bits
+        wide = bits * 2
+
+        # Values are below the limit, so they have k bits. Split them at a
+        # word boundary h, as x = hi * 2 ^ h + lo. Then x ^ 2 = lo ^ 2 +
+        # hi * lo * 2 ^ (h + 1) + hi ^ 2 * 2 ^ 2h: three narrower products,
+        # rather than one product twice as wide as those.
+        k = self.limit.bit_length()
+        h = -(-k // 128) * 64
+        g = k - h
+
+        if g <= 0:
+            yield f"%s.0 = zext i{bits} %0 to i{wide}"
+            yield f"%2 = mul i{wide} %s.0, %s.0"
+            yield from self.reduce(2)
+            return
+
+        yield f"%s.l = trunc i{bits} %0 to i{h}"
+        yield f"%s.u = lshr i{bits} %0, {h}"
+        yield f"%s.h = trunc i{bits} %s.u to i{g}"
+        yield f"%s.lw = zext i{h} %s.l to i{h * 2}"
+        yield f"%s.hw = zext i{g} %s.h to i{g * 2}"
+        yield f"%s.ll = mul i{h * 2} %s.lw, %s.lw"
+        yield f"%s.hh = mul i{g * 2} %s.hw, %s.hw"
+        yield f"%s.lk = zext i{h} %s.l to i{k}"
+        yield f"%s.hk = zext i{g} %s.h to i{k}"
+        yield f"%s.lh = mul i{k} %s.lk, %s.hk"
+        yield f"%s.0 = zext i{h * 2} %s.ll to i{wide}"
+        yield f"%s.1 = zext i{g * 2} %s.hh to i{wide}"
+        yield f"%s.2 = zext i{k} %s.lh to i{wide}"
+        yield f"%s.3 = shl i{wide} %s.1, {h * 2}"
+        yield f"%s.4 = shl i{wide} %s.2, {h + 1}"
+        yield f"%s.5 = or i{wide} %s.0, %s.3"
+        yield f"%2 = add i{wide} %s.5, %s.4"
+        yield from self.reduce(2)
+
+    @abc.abstractmethod
+    def reduce(self, r):
+        "Emits the reduction of the double width product in %{r}."
+
+
+class SerialMulFunction(MulFunction):
+    "Multiplies using a bit-serial double-and-add loop."
+
+    reduction = "serial"
+
+    def square(self):
+        yield f"%2 = {self.call('mul', '%0', '%0')}"
+        yield f"ret i{self.bits} %2"
+
+    def body(self):
+        t = self.type
+
+        def step(tag, o, state):
+            x, y = state
+            yield from self.bit(f"%c{tag}", "%1", o)
+            yield f"%s{tag} = select i1 %c{tag}, {t} {x}, {t} {y}"
+            yield f"%a{tag} = {self.call('add', x, y)}"
+            yield f"%d{tag} = {self.call('add', f'%s{tag}', f'%s{tag}')}"
+            yield f"%x{tag} = select i1 %c{tag}, {t} %d{tag}, {t} %a{tag}"
+            yield f"%y{tag} = select i1 %c{tag}, {t} %a{tag}, {t} %d{tag}"
+            return [f"%x{tag}", f"%y{tag}"]
+
+        x, y = yield from self.repeat(self.bits, ["%0", "0"], step)
+        yield f"ret {t} {y}"
+
+
+class MontgomeryMulFunction(WideMulFunction):
+    """Multiplies in Montgomery form using a single wide multiplication.
+
+    Values are kept as x * R (mod limit) where R = 2 ^ bits. Arguments are
+    converted on entry (multiplying by R ^ 2) and results on exit
+    (multiplying by 1). Both constants are derived here from the limit.
+    """
+
+    reduction = "montgomery"
+
+    def __init__(self, limit, limbs=False):
+        super().__init__(limit, limbs)
+
+        if limit % 2 == 0:
+            raise ValueError("Montgomery reduction requires an odd limit!")
+
+        self.rbits = self.limbs * 64 or self.bits
+        r = 1 << self.rbits
+        self.r2 = r * r % limit
+        self.ninv = -inverse(limit, r) % r
+
+    def encode(self, value):
+        return (value << self.rbits) % self.limit
+
+    def enter(self, value):
+        r = yield self.call("mul", value, self.const(self.r2))
+        return f"%{r}"
+
+    def leave(self, value):
+        r = yield self.call("mul", value, self.const(1))
+        return f"%{r}"
+
+    def reduce(self, r):
+        bits = self.bits
+        wide = bits * 2
+
+        # m = (t * -limit ^ -1) mod R; u = (t + m * limit) / R
+        yield f"%{r+1} = trunc i{wide} %{r} to i{bits}"
+        yield f"%{r+2} = mul i{bits} %{r+1}, {self.ninv}"
+        yield f"%{r+3} = zext i{bits} %{r+2} to i{wide}"
+        yield f"%{r+4} = mul i{wide} %{r+3}, {self.limit}"
+        yield f"%{r+5} = add i{wide} %{r}, %{r+4}"
+        yield f"%{r+6} = lshr i{wide} %{r+5}, {bits}"
+        yield f"%{r+7} = trunc i{wide} %{r+6} to i{bits}"
+
+        # u < 2 * limit, so a single conditional subtraction completes it.
+        yield f"%{r+8} = sub i{bits} %{r+7}, {self.limit}"
+        yield f"%{r+9} = icmp ult i{bits} %{r+7}, {self.limit}"
+        yield f"%{r+10} = select i1 %{r+9}, i{bits} %{r+7}, i{bits} %{r+8}"
+        yield f"ret i{bits} %{r+10}"
+
+
+class SolinasMulFunction(WideMulFunction):
+    """Multiplies, then reduces using the special form of the limit.
+
+    A limit of the form 2 ^ k - c, where c has only a few signed binary
+    terms, allows the part of the product above 2 ^ k to be folded back in
+    with shifts and adds, since 2 ^ k = c (mod limit). This covers the
+    pseudo-Mersenne (2 ^ 255 - 19) and Solinas (P-256, P-384, Goldilocks)
+    primes. Each fold is planned here against a bound on the value, so the
+    emitted code is a fixed sequence of folds followed by conditional
+    subtractions of the limit.
+    """
+
+    reduction = "solinas"
+    maxterms = 8    # Most terms in c (as signed binary) we accept
+    mingap = 16     # Fewest bits each fold must remove
+    maxfolds = 4    # Most folds for which we beat Montgomery ("auto")
+
+    @classmethod
+    def shape(cls, limit):
+        "Returns the terms of c as (sign, exponent) or None if not special."
+        k = limit.bit_length()
+        c = (1 << k) - limit
+
+        terms = naf(c)
+        if bin(c).count("1") <= len(terms):
+            terms = [(1, e) for e in range(k) if c & (1 << e)]
+
+        if len(terms) > cls.maxterms:
+            return None
+        if max(e for s, e in terms) > k - cls.mingap:
+            return None
+
+        return terms
+
+    def __init__(self, limit):
+        super().__init__(limit)
+
+        self.terms = self.shape(limit)
+        if self.terms is None:
+            raise ValueError("Limit is not of a special form!")
+
+        # Plan the folds: x = lo + hi * c + o, where o is a multiple of the
+        # limit large enough to keep the subtracted terms from underflowing.
+        # Each fold is emitted at the narrowest word multiple that holds it.
+        k = limit.bit_length()
+        pos = sum(1 << e for s, e in self.terms if s > 0)
+        neg = sum(1 << e for s, e in self.terms if s < 0)
+
+        self.folds = []
+        self.max = (limit - 1) ** 2   # Largest possible value
+        w = self.bits * 2
+
+        while self.max >> k:
+            hi = self.max >> k
+            o = -(-hi * neg // limit) * limit
+            top = (1 << k) - 1 + hi * pos + o
+            if top >= self.max:
+                break
+
+            w = min(w, -(-top.bit_length() // 64) * 64)
+            self.folds.append((o, w))
+            self.max = top
+
+    def reduce(self, r):
+        bits = self.bits
+        limit = self.limit
+        k = limit.bit_length()
 
-        r = 4
-        for o in range(bits - 1, -1, -1):
-            yield f"%{r+1} = and i{bits} %1, {1 << o}"
-            yield f"%{r+2} = icmp ne i{bits} %{r+1}, 0"
-            yield f"%{r+3} = select i1 %{r+2}, i{bits} %{r-1}, i{bits} %{r-0}"
-            yield f"%{r+4} = call i{bits} @add(i{bits} %{r-1}, i{bits} %{r-0})"
-            yield f"%{r+5} = call i{bits} @add(i{bits} %{r+3}, i{bits} %{r+3})"
-            yield f"%{r+6} = select i1 %{r+2}, i{bits} %{r+5}, i{bits} %{r+4}"
-            yield f"%{r+7} = select i1 %{r+2}, i{bits} %{r+4}, i{bits} %{r+5}"
-            r += 7
+        w = bits * 2
+        for o, n in self.folds:
+            yield f"%{r+1} = lshr i{w} %{r}, {k}"
+            yield f"%{r+2} = and i{w} %{r}, {(1 << k) - 1}"
+            r += 2
+            if n < w:
+                yield f"%{r+1} = trunc i{w} %{r-1} to i{n}"
+                yield f"%{r+2} = trunc i{w} %{r-0} to i{n}"
+                r += 2
 
-        yield f"ret i{bits} %{r-0}"
+            h = r - 1
+            yield f"%{r+1} = add i{n} %{r}, {o}"
+            r += 1
+
+            for s, e in self.terms:
+                yield f"%{r+1} = shl i{n} %{h}, {e}"
+                yield f"%{r+2} = {'add' if s > 0 else 'sub'} i{n} %{r}, %{r+1}"
+                r += 2
+
+            w = n
+
+        # Now x < limit * 2 ^ m: subtract each limit * 2 ^ j if it fits.
+        m = 0
+        while limit << m <= self.max:
+            m += 1
+
+        for j in range(m - 1, -1, -1):
+            yield f"%{r+1} = sub i{w} %{r}, {limit << j}"
+            yield f"%{r+2} = icmp ult i{w} %{r}, {limit << j}"
+            yield f"%{r+3} = select i1 %{r+2}, i{w} %{r}, i{w} %{r+1}"
+            r += 3
+
+        if w > bits:
+            yield f"%{r+1} = trunc i{w} %{r} to i{bits}"
+            r += 1
+        elif w < bits:
+            yield f"%{r+1} = zext i{w} %{r} to i{bits}"
+            r += 1
+
+        yield f"ret i{bits} %{r}"
+
+
+class LimbFunction(Function):
+    """Base for functions on arrays of 64-bit limbs.
+
+    Limbs are little-endian. Carry chains are explicit: each limb is
+    widened to i128, so the carry (or borrow) is bit 64 (or 127) of the sum.
+    """
+
+    def __init__(self, limit):
+        super().__init__(limit, True)
+
+    def words(self, value, name):
+        "Emits %{name}{i} = limb i of value."
+        for i in range(self.limbs):
+            yield f"%{name}{i} = extractvalue {self.type} {value}, {i}"
+
+    def pack(self, name, words):
+        "Emits %{name} = the limbs in words."
+        prev = "undef"
+        for i, w in enumerate(words):
+            dst = f"%{name}.{i}" if i < len(words) - 1 else f"%{name}"
+            yield f"{dst} = insertvalue {self.type} {prev}, i64 {w}, {i}"
+            prev = dst
+
+    def chain(self, op, name, a, b):
+        """Emits %{name}{i} = a op b, as an add or sub carry chain.
+
+        Returns the name of the final carry (or borrow) as an i1.
+        """
+        c = None
+        for i, (x, y) in enumerate(zip(a, b)):
+            n = f"%{name}{i}"
+            yield f"{n}.x = zext i64 {x} to i128"
+            yield f"{n}.y = zext i64 {y} to i128"
+            yield f"{n}.s = {op} i128 {n}.x, {n}.y"
+            if c is not None:
+                yield f"{n}.t = {op} i128 {n}.s, {c}"
+            else:
+                yield f"{n}.t = add i128 {n}.s, 0"
+            yield f"{n} = trunc i128 {n}.t to i64"
+            yield f"{n}.c = lshr i128 {n}.t, {64 if op == 'add' else 127}"
+            c = f"{n}.c"
+
+        yield f"%{name}.c = trunc i128 {c} to i1"
+        return f"%{name}.c"
+
+    def limit_words(self, n=None):
+        return [self.limit >> 64 * i & (1 << 64) - 1
+                for i in range(n or self.limbs)]
+
+
+class LimbAddFunction(LimbFunction):
+    name = "add"
+
+    def body(self):
+        n = self.limbs
+        t = self.type
+
+        yield from self.words("%0", "a")
+        yield from self.words("%1", "b")
+        a = [f"%a{i}" for i in range(n)]
+        b = [f"%b{i}" for i in range(n)]
+        s = [f"%s{i}" for i in range(n)]
+        d = [f"%d{i}" for i in range(n)]
+
+        # Keep s = a + b if it didn't carry and s - limit borrowed.
+        c = yield from self.chain("add", "s", a, b)
+        w = yield from self.chain("sub", "d", s, self.limit_words())
+        yield f"%nc = xor i1 {c}, true"
+        yield f"%keep = and i1 %nc, {w}"
+        yield from self.pack("s", s)
+        yield from self.pack("d", d)
+        yield f"%r = select i1 %keep, {t} %s, {t} %d"
+        yield f"ret {t} %r"
+
+
+class LimbSubFunction(LimbFunction):
+    name = "sub"
+
+    def body(self):
+        n = self.limbs
+        t = self.type
+
+        yield from self.words("%0", "a")
+        yield from self.words("%1", "b")
+        a = [f"%a{i}" for i in range(n)]
+        b = [f"%b{i}" for i in range(n)]
+        d = [f"%d{i}" for i in range(n)]
+        e = [f"%e{i}" for i in range(n)]
+
+        # Use d = a - b, adding the limit back if it borrowed.
+        w = yield from self.chain("sub", "d", a, b)
+        yield from self.chain("add", "e", d, self.limit_words())
+        yield from self.pack("d", d)
+        yield from self.pack("e", e)
+        yield f"%r = select i1 {w}, {t} %e, {t} %d"
+        yield f"ret {t} %r"
+
+
+class LimbMulFunction(LimbFunction, MontgomeryMulFunction):
+    """Multiplies in Montgomery form on 64-bit limbs.
+
+    This is the coarsely integrated operand scanning (CIOS) method: for each
+    limb of b, add a * b[i] to the accumulator, then add the multiple of the
+    limit that clears its lowest limb and shift it down by one limb.
+    """
+
+    def mac(self, name, t, c, x=None, y=None):
+        "Emits %{name} = low limb of (t + c + x * y); %{name}.h = high limb."
+        v = f"%{name}.s"
+        yield f"%{name}.t = zext i64 {t} to i128"
+        yield f"{v} = add i128 %{name}.t, {c}"
+        if x is not None:
+            yield f"%{name}.p = mul i128 {x}, {y}"
+            yield f"%{name}.c = add i128 {v}, %{name}.p"
+            v = f"%{name}.c"
+        yield f"%{name} = trunc i128 {v} to i64"
+        yield f"%{name}.h = lshr i128 {v}, 64"
+
+    def body(self):
+        n = self.limbs
+        p = self.limit_words()
+        ninv = self.ninv & (1 << 64) - 1
+
+        yield from self.words("%0", "a")
+        yield from self.words("%1", "b")
+        for i in range(n):
+            yield f"%a{i}.w = zext i64 %a{i} to i128"
+            yield f"%b{i}.w = zext i64 %b{i} to i128"
+
+        t = ["0"] * (n + 2)
+        for i in range(n):
+            # t += a * b[i]
+            c = "0"
+            for j in range(n):
+                yield from self.mac(f"x{i}.{j}", t[j], c,
+                                    f"%a{j}.w", f"%b{i}.w")
+                t[j] = f"%x{i}.{j}"
+                c = f"%x{i}.{j}.h"
+
+            yield from self.mac(f"x{i}.{n}", t[n], c)
+            yield f"%x{i}.{n+1} = trunc i128 %x{i}.{n}.h to i64"
+            t[n] = f"%x{i}.{n}"
+            t[n+1] = f"%x{i}.{n+1}"
+
+            # t = (t + q * limit) / 2 ^ 64, where q clears the lowest limb
+            yield f"%q{i} = mul i64 {t[0]}, {ninv}"
+            yield f"%q{i}.w = zext i64 %q{i} to i128"
+            c = "0"
+            for j in range(n):
+                yield from self.mac(f"y{i}.{j}", t[j], c, f"%q{i}.w", p[j])
+                if j:
+                    t[j - 1] = f"%y{i}.{j}"
+                c = f"%y{i}.{j}.h"
+
+            yield from self.mac(f"y{i}.{n}", t[n], c)
+            yield f"%y{i}.{n+1} = trunc i128 %y{i}.{n}.h to i64"
+            yield f"%y{i}.{n+2} = add i64 {t[n+1]}, %y{i}.{n+1}"
+            t[n-1] = f"%y{i}.{n}"
+            t[n] = f"%y{i}.{n+2}"
+            t[n+1] = "0"
+
+        yield from self.final(t[:n+1])
+
+    def square(self):
+        """Squares using separated operand scanning (SOS).
+
+        Each cross product a[i] * a[j] (i < j) is computed once and the sum
+        doubled with a shift, so squaring needs n (n + 1) / 2 limb products
+        rather than n ^ 2. The double width square is then reduced a limb
+        at a time, like the second half of each step of body().
+        """
+        n = self.limbs
+        p = self.limit_words()
+        ninv = self.ninv & (1 << 64) - 1
+
+        yield from self.words("%0", "a")
+        for i in range(n):
+            yield f"%a{i}.w = zext i64 %a{i} to i128"
+
+        # t = the sum of the cross products
+        t = ["0"] * (2 * n + 1)
+        for i in range(n - 1):
+            c = "0"
+            for j in range(i + 1, n):
+                yield from self.mac(f"x{i}.{j}", t[i+j], c,
+                                    f"%a{i}.w", f"%a{j}.w")
+                t[i+j] = f"%x{i}.{j}"
+                c = f"%x{i}.{j}.h"
+
+            yield f"%x{i}.{n} = trunc i128 {c} to i64"
+            t[i+n] = f"%x{i}.{n}"
+
+        # t = 2 * t + the squares a[i] ^ 2
+        u = []
+        for k in range(2 * n):
+            yield f"%u{k}.l = shl i64 {t[k]}, 1"
+            if k:
+                yield f"%u{k}.r = lshr i64 {t[k-1]}, 63"
+                yield f"%u{k} = or i64 %u{k}.l, %u{k}.r"
+            else:
+                yield f"%u{k} = or i64 %u{k}.l, 0"
+            u.append(f"%u{k}")
+
+        d = []
+        for i in range(n):
+            yield f"%sq{i} = mul i128 %a{i}.w, %a{i}.w"
+            yield f"%sq{i}.u = lshr i128 %sq{i}, 64"
+            yield f"%sq{i}.l = trunc i128 %sq{i} to i64"
+            yield f"%sq{i}.h = trunc i128 %sq{i}.u to i64"
+            d += [f"%sq{i}.l", f"%sq{i}.h"]
+
+        yield from self.chain("add", "v", u, d)
+        t = [f"%v{k}" for k in range(2 * n)] + ["0"]
+
+        # t = (t + q * limit) / 2 ^ 64, n times, where q clears limb i
+        for i in range(n):
+            yield f"%q{i} = mul i64 {t[i]}, {ninv}"
+            yield f"%q{i}.w = zext i64 %q{i} to i128"
+            c = "0"
+            for j in range(n):
+                yield from self.mac(f"y{i}.{j}", t[i+j], c, f"%q{i}.w", p[j])
+                t[i+j] = f"%y{i}.{j}"
+                c = f"%y{i}.{j}.h"
+
+            for k in range(i + n, 2 * n + 1):
+                yield from self.mac(f"y{i}.{k-i}", t[k], c)
+                t[k] = f"%y{i}.{k-i}"
+                c = f"%y{i}.{k-i}.h"
+
+        yield from self.final(t[n:])
+
+    def final(self, t):
+        "Emits the return of t (n + 1 limbs) less the limit, if it fits."
+        n = self.limbs
+
+        # t < 2 * limit: subtract the limit (over n + 1 limbs) if it fits.
+        d = [f"%d{i}" for i in range(n)]
+        w = yield from self.chain("sub", "d", t, self.limit_words(n+1))
+        yield from self.pack("t", t[:n])
+        yield from self.pack("d", d)
+        yield f"%r = select i1 {w}, {self.type} %t, {self.type} %d"
+        yield f"ret {self.type} %r"
+
+
+class SqrFunction(Function):
+    "Squares, using the squaring of the multiplication function given."
+
+    name = "sqr"
+    args = 1
+
+    def __init__(self, mul):
+        super().__init__(mul.limit, bool(mul.limbs))
+        self.mul = mul
+
+    def body(self):
+        yield from self.mul.square()
 
 
 class ExpFunction(Function):
+    """Exponentiates, either with a ladder or with a fixed window.
+
+    The ladder does two multiplications per exponent bit. The fixed window
+    does one squaring per bit and one multiplication per window. It selects
+    that multiplication's operand from a table of powers of the base. The
+    selection scans the whole table with masks, so it is constant time.
+    """
+
     name = "exp"
     op = "@"
 
+    def __init__(self, limit, one=1, limbs=False, window="auto", unroll=True):
+        super().__init__(limit, limbs, unroll)
+        self.one = one
+        self.top = min(self.limbs * 64 or self.bits, self.bits)
+
+        # By default, pick the width that needs the fewest multiplications
+        # for the table and the windows together.
+        if window == "auto":
+            window = min(range(1, 9),
+                         key=lambda w: 2 ** w - 2 + -(-self.top // w))
+        if window is not False:
+            if type(window) is not int or not 0 < window <= 8:
+                raise ValueError(f"Invalid window '{window}'!")
+        self.window = window
+
     def body(self):
-        bits = self.bits
+        if self.window:
+            yield from self.windowed()
+        else:
+            yield from self.ladder()
+
+    def ladder(self):
+        t = self.type
+
+        def step(tag, o, state):
+            x, y = state
+            yield from self.bit(f"%c{tag}", exp.get(type(o), "%1"), o)
+            yield f"%s{tag} = select i1 %c{tag}, {t} {x}, {t} {y}"
+            yield f"%m{tag} = {self.call('mul', x, y)}"
+            yield f"%q{tag} = {self.call('sqr', f'%s{tag}')}"
+            yield f"%x{tag} = select i1 %c{tag}, {t} %q{tag}, {t} %m{tag}"
+            yield f"%y{tag} = select i1 %c{tag}, {t} %m{tag}, {t} %q{tag}"
+            return [f"%x{tag}", f"%y{tag}"]
+
+        # Bits at constant offsets are read from the argument; at runtime
+        # offsets, from its spill().
+        exp = {}
+        if self.unroll is not True:
+            exp[str] = yield from self.spill("%e", "%1")
+
+        state = ["%0", self.const(self.one)]
+        x, y = yield from self.repeat(self.top, state, step)
+        yield f"ret {t} {y}"
+
+    def windowed(self):
+        t = self.type
+        w = self.window
+        zero = self.const(0)
+
+        def select(tag, o):
+            "Emits %s{tag}, the table entry for the digit at offset o."
+            yield from self.digit(f"%d{tag}", exp.get(type(o), "%1"), o, w)
+
+            sel = zero
+            for i, e in enumerate(tbl):
+                yield f"%e{tag}.{i} = icmp eq i32 %d{tag}, {i}"
+                yield from self.mask(f"%s{tag}.{i}", f"%e{tag}.{i}", e, sel)
+                sel = f"%s{tag}.{i}"
+
+            return sel
+
+        def step(tag, k, state):
+            acc, = state
+            o = k * w
+            if not isinstance(k, int):
+                o = f"%o{tag}"
+                yield f"{o} = mul i32 {k}, {w}"
+
+            sel = yield from select(tag, o)
+            for j in range(w):
+                yield f"%q{tag}.{j} = {self.call('sqr', acc)}"
+                acc = f"%q{tag}.{j}"
+
+            yield f"%a{tag} = {self.call('mul', acc, sel)}"
+            return [f"%a{tag}"]
+
+        exp = {}
+        if self.unroll is not True:
+            exp[str] = yield from self.spill("%x", "%1")
+
+        # Table of base ^ i
+        tbl = [self.const(self.one), "%0"]
+        for i in range(2, 2 ** w):
+            if i == 2:
+                yield f"%t{i} = {self.call('sqr', '%0')}"
+            else:
+                yield f"%t{i} = {self.call('mul', tbl[i - 1], '%0')}"
+            tbl.append(f"%t{i}")
+
+        # The top digit starts the accumulator; the others are steps.
+        k = -(-self.top // w) - 1
+        acc = yield from select(f"{k}", k * w)
+        acc, = yield from self.repeat(k, [acc], step)
+        yield f"ret {t} {acc}"
+
+
+class FixedExpFunction(Function):
+    """Exponentiates a constant base, with a table precomputed at compile time.
+
+    The exponent is split into windows of w bits. Row i of the table holds
+    base ^ (d << w * i) for each digit d, so the power is the product of one
+    entry per row, without any squarings. Entries are selected by scanning
+    the whole row with masks, so it is constant time. The rows are always
+    stepped through in a loop: at a runtime row, the table is read from
+    memory rather than folded into the code.
+    """
+
+    args = 1
+    attributes = ("nounwind", "readonly")
+
+    def __init__(self, mul, base, name, window="auto", unroll=True):
+        unroll = 1 if unroll is True else unroll
+        super().__init__(mul.limit, bool(mul.limbs), unroll)
+        self.name = name
+        self.base = base
+        top = min(self.limbs * 64 or self.bits, self.bits)
+
+        # By default, pick the width doing the least work. Each row costs a
+        # multiplication, weighed as twice the words, and a scan of the row.
+        if window == "auto":
+            words = -(-self.bits // 64)
+            window = min(range(1, 9),
+                         key=lambda w: -(-top // w) * (2 * words + 2 ** w))
+        if type(window) is not int or not 0 < window <= 8:
+            raise ValueError(f"Invalid window '{window}'!")
+        self.window = window
+
+        self.table = []
+        b = base % self.limit
+        for i in range(-(-top // window)):
+            row = [1]
+            for d in range(1, 2 ** window):
+                row.append(row[-1] * b % self.limit)
+            self.table.append([self.const(mul.encode(x)) for x in row])
+            b = row[-1] * b % self.limit
+
+    def __call__(self, policy=None):
+        t = self.type
+        rows = ", ".join(f"[{2 ** self.window} x {t}] [" +
+                         ", ".join(f"{t} {x}" for x in row) + "]"
+                         for row in self.table)
+        yield f"@{self.name}.table = private unnamed_addr constant " \
+              f"{self.array} [{rows}]"
+        yield from super().__call__(policy)
+
+    @property
+    def array(self):
+        return f"[{len(self.table)} x [{2 ** self.window} x {self.type}]]"
+
+    def body(self):
+        t = self.type
+        w = self.window
+        a = self.array
+        zero = self.const(0)
+
+        def select(tag, k):
+            "Emits %s{tag}, the entry of row k for the digit of window k."
+            o = k * w
+            if not isinstance(k, int):
+                o = f"%o{tag}"
+                yield f"{o} = mul i32 {k}, {w}"
+            yield from self.digit(f"%d{tag}", exp.get(type(o), "%0"), o, w)
 
-        yield f"%3 = add i{bits} %0, 0"
-        yield f"%4 = add i{bits} 1, 0"
+            sel = zero
+            for i in range(2 ** w):
+                e = f"%e{tag}.{i}"
+                yield f"{e}.p = getelementptr {a}, {a}* @{self.name}.table, " \
+                      f"i32 0, i32 {k}, i32 {i}"
+                yield f"{e}.v = load {t}, {t}* {e}.p"
+                yield f"{e} = icmp eq i32 %d{tag}, {i}"
+                yield from self.mask(f"%s{tag}.{i}", e, f"{e}.v", sel)
+                sel = f"%s{tag}.{i}"
 
-        r = 4
-        for o in range(bits - 1, -1, -1):
-            yield f"%{r+1} = and i{bits} %1, {1 << o}"
-            yield f"%{r+2} = icmp ne i{bits} %{r+1}, 0"
-            yield f"%{r+3} = select i1 %{r+2}, i{bits} %{r-1}, i{bits} %{r-0}"
-            yield f"%{r+4} = call i{bits} @mul(i{bits} %{r-1}, i{bits} %{r-0})"
-            yield f"%{r+5} = call i{bits} @mul(i{bits} %{r+3}, i{bits} %{r+3})"
-            yield f"%{r+6} = select i1 %{r+2}, i{bits} %{r+5}, i{bits} %{r+4}"
-            yield f"%{r+7} = select i1 %{r+2}, i{bits} %{r+4}, i{bits} %{r+5}"
-            r += 7
+            return sel
 
-        yield f"ret i{bits} %{r-0}"
+        def step(tag, k, state):
+            acc, = state
+            sel = yield from select(tag, k)
+            yield f"%a{tag} = {self.call('mul', acc, sel)}"
+            return [f"%a{tag}"]
+
+        exp = {}
+        exp[str] = yield from self.spill("%x", "%0")
+
+        # The top row starts the accumulator; the others are steps.
+        k = len(self.table) - 1
+        acc = yield from select(f"{k}", k)
+        acc, = yield from self.repeat(k, [acc], step)
+        yield f"ret {t} {acc}"
+
+
+class InvFunction(Function):
+    """Base for inversions, which differ in their algorithm.
+
+    The inverse of zero is zero, as with x @ (limit - 2).
+    """
+
+    name = "inv"
+    args = 1
+    inversion = None
+
+    @classmethod
+    def find_inversion(cls, inversion):
+        for c in cls.__subclasses__():
+            if c.inversion == inversion:
+                return c
+        raise ValueError(f"Unknown inversion '{inversion}'!")
+
+    def __init__(self, mul, unroll=True):
+        super().__init__(mul.limit, bool(mul.limbs), unroll)
+        self.mul = mul
+
+
+class FermatInvFunction(InvFunction):
+    "Inverts by exponentiation to limit - 2 (for a prime limit)."
+
+    inversion = "fermat"
+
+    def body(self):
+        e = self.const(self.limit - 2)
+        yield f"%2 = {self.call('exp', '%0', e)}"
+        yield f"ret {self.type} %2"
+
+
+class SafegcdInvFunction(InvFunction):
+    """Inverts with the constant-time divsteps of Bernstein and Yang.
+
+    Each divstep halves g, after swapping f and g and negating one of them
+    depending on the sign of delta and the parity of g. Starting from the
+    limit and x, the gcd of 1 ends up in f (as 1 or -1) with g at zero. The
+    same steps applied to d and e, which start at 0 and 1, give the inverse.
+
+    The steps of a jump depend only on the lowest bits of f and g. So each
+    jump does 62 divsteps on 64-bit words, collecting them in a matrix that
+    is then applied to the wide values. d and e are kept below the limit
+    by adding the multiple of the limit that makes them divisible by 2 ^ 62.
+
+    There are always enough jumps for the worst case. The divsteps use masks
+    rather than branches or selects, so it is constant time.
+    """
+
+    inversion = "safegcd"
+    batch = 62  # Divsteps per jump
+
+    def __init__(self, mul, unroll=True):
+        super().__init__(mul, 1 if unroll is True else unroll)
+
+        # Signed values of the limit's size times 2 ^ 62, plus a sign bit.
+        d = self.limit.bit_length()
+        self.wide = 64 * -(-(d + 65) // 64)
+
+        # Steps needed in the worst case, from the paper: Theorem 11.2.
+        steps = (49 * d + 80) // 17 if d < 46 else (49 * d + 57) // 17
+        self.jumps = -(-steps // self.batch)
+
+        # Values in Montgomery form are x R. The result is then e / x R,
+        # so starting e at R ^ 2 gives the inverse in Montgomery form.
+        self.scale = mul.encode(mul.encode(1))
+        self.pinv = inverse(self.limit, 1 << self.batch)
+
+    def widen(self, dst, value):
+        "Emits dst = value, from our type to a wide signed integer."
+        w = f"i{self.wide}"
+        if not self.limbs:
+            yield f"{dst} = zext i{self.bits} {value} to {w}"
+            return dst
+
+        acc = "0"
+        for i in range(self.limbs):
+            n = dst if i == self.limbs - 1 else f"{dst}.o{i}"
+            yield f"{dst}.w{i} = extractvalue {self.type} {value}, {i}"
+            yield f"{dst}.z{i} = zext i64 {dst}.w{i} to {w}"
+            yield f"{dst}.s{i} = shl {w} {dst}.z{i}, {64 * i}"
+            yield f"{n} = or {w} {acc}, {dst}.s{i}"
+            acc = n
+        return dst
+
+    def narrow(self, dst, value):
+        "Emits dst = value, from a wide signed integer to our type."
+        w = f"i{self.wide}"
+        if not self.limbs:
+            yield f"{dst} = trunc {w} {value} to i{self.bits}"
+            return
+
+        prev = "undef"
+        for i in range(self.limbs):
+            n = dst if i == self.limbs - 1 else f"{dst}.{i}"
+            yield f"{dst}.s{i} = lshr {w} {value}, {64 * i}"
+            yield f"{dst}.w{i} = trunc {w} {dst}.s{i} to i64"
+            yield f"{n} = insertvalue {self.type} {prev}, i64 {dst}.w{i}, {i}"
+            prev = n
+
+    def divstep(self, tag, delta, f, g, u, v, q, r):
+        """Emits a divstep on 64-bit words, with its transition matrix.
+
+        Without branches, s is all ones to swap and o all ones if g is odd:
+        g += (s ? -f : f) & o, then f += g & s (so f becomes g on a swap).
+        The matrix (u, v, q, r) is updated alike, and then g is halved while
+        u and v are doubled.
+        """
+        x = f"%{tag}"
+        yield f"{x}.b = and i64 {g}, 1"
+        yield f"{x}.o = sub i64 0, {x}.b"
+        yield f"{x}.p = icmp sgt i64 {delta}, 0"
+        yield f"{x}.m = sext i1 {x}.p to i64"
+        yield f"{x}.s = and i64 {x}.m, {x}.o"
+
+        for n, a, b in (("g", f, g), ("q", u, q), ("r", v, r)):
+            yield f"{x}.{n}x = xor i64 {a}, {x}.s"
+            yield f"{x}.{n}n = sub i64 {x}.{n}x, {x}.s"
+            yield f"{x}.{n}a = and i64 {x}.{n}n, {x}.o"
+            yield f"{x}.{n} = add i64 {b}, {x}.{n}a"
+
+        for n, a, b in (("f", f, "g"), ("u", u, "q"), ("v", v, "r")):
+            yield f"{x}.{n}a = and i64 {x}.{b}, {x}.s"
+            yield f"{x}.{n} = add i64 {a}, {x}.{n}a"
+
+        yield f"{x}.dx = xor i64 {delta}, {x}.s"
+        yield f"{x}.dn = sub i64 {x}.dx, {x}.s"
+        yield f"{x}.d = add i64 {x}.dn, 1"
+        yield f"{x}.gh = ashr i64 {x}.g, 1"
+        yield f"{x}.ud = shl i64 {x}.u, 1"
+        yield f"{x}.vd = shl i64 {x}.v, 1"
+        return [f"{x}.d", f"{x}.f", f"{x}.gh", f"{x}.ud", f"{x}.vd",
+                f"{x}.q", f"{x}.r"]
+
+    def combine(self, dst, a, b, x, y):
+        "Emits dst = a * x + b * y, for 64-bit a and b and wide x and y."
+        w = f"i{self.wide}"
+        yield f"{dst}.a = sext i64 {a} to {w}"
+        yield f"{dst}.b = sext i64 {b} to {w}"
+        yield f"{dst}.x = mul {w} {dst}.a, {x}"
+        yield f"{dst}.y = mul {w} {dst}.b, {y}"
+        yield f"{dst} = add {w} {dst}.x, {dst}.y"
+
+    def reduce(self, dst, a, b, x, y):
+        """Emits dst = (a * x + b * y) / 2 ^ 62 modulo the limit.
+
+        The limit's multiple added makes the sum divisible. The result is
+        then in (-2 limit, 2 limit), and is brought below the limit.
+        """
+        w = f"i{self.wide}"
+        p = self.limit
+
+        yield from self.combine(f"{dst}.t", a, b, x, y)
+        yield f"{dst}.l = trunc {w} {dst}.t to i64"
+        yield f"{dst}.k = mul i64 {dst}.l, {self.pinv}"
+        yield f"{dst}.n = sub i64 0, {dst}.k"
+        yield f"{dst}.c = and i64 {dst}.n, {(1 << self.batch) - 1}"
+        yield f"{dst}.z = zext i64 {dst}.c to {w}"
+        yield f"{dst}.m = mul {w} {dst}.z, {p}"
+        yield f"{dst}.s = add {w} {dst}.t, {dst}.m"
+        yield f"{dst}.0 = ashr {w} {dst}.s, {self.batch}"
+
+        # Add the limit while negative (twice), then subtract it if above.
+        for i in range(2):
+            yield f"{dst}.i{i} = icmp slt {w} {dst}.{i}, 0"
+            yield f"{dst}.e{i} = sext i1 {dst}.i{i} to {w}"
+            yield f"{dst}.a{i} = and {w} {dst}.e{i}, {p}"
+            yield f"{dst}.{i + 1} = add {w} {dst}.{i}, {dst}.a{i}"
+        yield f"{dst}.i = icmp sge {w} {dst}.2, {p}"
+        yield f"{dst}.e = sext i1 {dst}.i to {w}"
+        yield f"{dst}.a = and {w} {dst}.e, {p}"
+        yield f"{dst} = sub {w} {dst}.2, {dst}.a"
+
+    def body(self):
+        w = f"i{self.wide}"
+        p = self.limit
+        n = self.batch
+
+        def step(tag, i, state):
+            delta, f, g, d, e = state
+            yield f"%lf{tag} = trunc {w} {f} to i64"
+            yield f"%lg{tag} = trunc {w} {g} to i64"
+
+            m = [delta, f"%lf{tag}", f"%lg{tag}", 1, 0, 0, 1]
+            for j in range(n):
+                m = yield from self.divstep(f"s{tag}.{j}", *m)
+            delta, fl, gl, u, v, q, r = m
+
+            yield from self.combine(f"%ft{tag}", u, v, f, g)
+            yield from self.combine(f"%gt{tag}", q, r, f, g)
+            yield f"%f{tag} = ashr {w} %ft{tag}, {n}"
+            yield f"%g{tag} = ashr {w} %gt{tag}, {n}"
+            yield from self.reduce(f"%d{tag}", u, v, d, e)
+            yield from self.reduce(f"%e{tag}", q, r, d, e)
+            return [delta, f"%f{tag}", f"%g{tag}", f"%d{tag}", f"%e{tag}"]
+
+        x = yield from self.widen("%x", "%0")
+        state = [1, p, x, 0, self.scale]
+        types = ["i64", w, w, w, w]
+        delta, f, g, d, e = yield from self.repeat(self.jumps, state, step,
+                                                   types)
+
+        # f is 1 or -1: the inverse is d or -d.
+        yield f"%n = icmp slt {w} {f}, 0"
+        yield f"%m = sext i1 %n to {w}"
+        yield f"%y = sub {w} {p}, {d}"
+        yield f"%z = sub {w} %y, {d}"
+        yield f"%a = and {w} %z, %m"
+        yield f"%b = add {w} {d}, %a"
+        yield f"%c = icmp eq {w} %b, {p}"
+        yield f"%k = sext i1 %c to {w}"
+        yield f"%l = and {w} %k, {p}"
+        yield f"%r = sub {w} %b, %l"
+        yield from self.narrow("%v", "%r")
+        yield f"ret {self.type} %v"
+
+
+class DivFunction(Function):
+    "Divides, by multiplying by the inverse."
+
+    name = "div"
+    op = "/"
+
+    def __init__(self, mul):
+        super().__init__(mul.limit, bool(mul.limbs))
+        self.mul = mul
+
+    def body(self):
+        yield f"%3 = {self.call(InvFunction.name, '%1')}"
+        yield f"%4 = {self.call(MulFunction.name, '%0', '%3')}"
+        yield f"ret {self.type} %4"
+
+
+class SqrtFunction(Function):
+    """Base for square roots, which differ in the shape of the limit.
+
+    The result is a square root of squares. For other values it is not, so
+    callers check it by squaring it. The exponents and the constants only
+    depend on the limit, so they are computed at compile time.
+    """
+
+    name = "sqrt"
+    args = 1
+    shape = None  # The limit's residue modulo a power of two
+
+    @classmethod
+    def find_shape(cls, limit):
+        for c in cls.__subclasses__():
+            m, r = c.shape
+            if limit % m == r:
+                return c
+        raise ValueError("Square roots require an odd limit!")
+
+    def __init__(self, mul, unroll=True):
+        super().__init__(mul.limit, bool(mul.limbs), unroll)
+        self.mul = mul
+
+    def encode(self, value):
+        "Formats a compile-time integer as a constant of the mul domain."
+        return self.const(self.mul.encode(value % self.limit))
+
+
+class EulerSqrtFunction(SqrtFunction):
+    "Roots x as x @ ((limit + 1) / 4), for limits of 3 modulo 4."
+
+    shape = (4, 3)
+
+    def body(self):
+        e = self.const((self.limit + 1) // 4)
+        yield f"%2 = {self.call(ExpFunction.name, '%0', e)}"
+        yield f"ret {self.type} %2"
+
+
+class AtkinSqrtFunction(SqrtFunction):
+    """Roots with Atkin's formula, for limits of 5 modulo 8.
+
+    With a = 2 x, t = a @ ((limit - 5) / 8) and i = a t ^ 2, the root is
+    x t (i - 1): i is a square root of -1 for squares.
+    """
+
+    shape = (8, 5)
+
+    def body(self):
+        e = self.const((self.limit - 5) // 8)
+        yield f"%a = {self.call(AddFunction.name, '%0', '%0')}"
+        yield f"%t = {self.call(ExpFunction.name, '%a', e)}"
+        yield f"%s = {self.call(SqrFunction.name, '%t')}"
+        yield f"%i = {self.call(MulFunction.name, '%a', '%s')}"
+        yield f"%j = {self.call(SubFunction.name, '%i', self.encode(1))}"
+        yield f"%u = {self.call(MulFunction.name, '%0', '%t')}"
+        yield f"%r = {self.call(MulFunction.name, '%u', '%j')}"
+        yield f"ret {self.type} %r"
+
+
+class TonelliShanksSqrtFunction(SqrtFunction):
+    """Roots with constant-time Tonelli-Shanks, for the other odd limits.
+
+    With limit - 1 = q 2 ^ s for an odd q, z = x @ ((q + 1) / 2) is a root
+    of x t, where t = x @ q is a 2 ^ s-th root of unity. Each step k, from
+    s down to 2, checks whether t is a 2 ^ (k - 2)-th power and if not,
+    multiplies z by a 2 ^ k-th root of unity c and t by c ^ 2. The roots of
+    unity are powers of a non-residue, computed at compile time.
+
+    Every step does all of its squarings and multiplications, selecting
+    the results with masks, so it is constant time.
+    """
+
+    shape = (2, 1)
+
+    def __init__(self, mul, unroll=True):
+        super().__init__(mul, unroll)
+        self.s = ((self.limit - 1) & (1 - self.limit)).bit_length() - 1
+        self.q = (self.limit - 1) >> self.s
+
+        c = pow(nonresidue(self.limit), self.q, self.limit)
+        self.roots = {k: pow(c, 1 << self.s - k, self.limit)
+                      for k in range(2, self.s + 1)}
+
+    def equal(self, dst, a, b):
+        "Emits dst = (a == b) as i1."
+        if not self.limbs:
+            yield f"{dst} = icmp eq {self.type} {a}, {b}"
+            return
+
+        acc = "0"
+        for i in range(self.limbs):
+            yield f"{dst}.a{i} = extractvalue {self.type} {a}, {i}"
+            yield f"{dst}.b{i} = extractvalue {self.type} {b}, {i}"
+            yield f"{dst}.x{i} = xor i64 {dst}.a{i}, {dst}.b{i}"
+            yield f"{dst}.o{i} = or i64 {acc}, {dst}.x{i}"
+            acc = f"{dst}.o{i}"
+        yield f"{dst} = icmp eq i64 {acc}, 0"
+
+    def squarings(self, tag, value, n):
+        "Emits value squared n times, with repeat(). Returns the result."
+        def step(i, o, state):
+            yield f"%{tag}.{i} = {self.call(SqrFunction.name, state[0])}"
+            return [f"%{tag}.{i}"]
+
+        state = yield from self.repeat(n, [value], step, prefix=tag)
+        return state[0]
+
+    def body(self):
+        mul = MulFunction.name
+        e = self.const((self.q - 1) // 2)
+        yield f"%y = {self.call(ExpFunction.name, '%0', e)}"
+        yield f"%ys = {self.call(SqrFunction.name, '%y')}"
+        z = "%z"
+        t = "%t"
+        yield f"{t} = {self.call(mul, '%ys', '%0')}"
+        yield f"{z} = {self.call(mul, '%y', '%0')}"
+
+        for k in range(self.s, 1, -1):
+            c = self.roots[k]
+            b = yield from self.squarings(f"b{k}", t, k - 2)
+            yield from self.equal(f"%e{k}", b, self.encode(1))
+            yield f"%n{k} = xor i1 %e{k}, true"
+
+            yield f"%zc{k} = {self.call(mul, z, self.encode(c))}"
+            yield from self.mask(f"%zm{k}", f"%n{k}", f"%zc{k}", self.const(0))
+            yield from self.mask(f"%z{k}", f"%e{k}", z, f"%zm{k}")
+
+            yield f"%tc{k} = {self.call(mul, t, self.encode(c * c))}"
+            yield from self.mask(f"%tm{k}", f"%n{k}", f"%tc{k}", self.const(0))
+            yield from self.mask(f"%t{k}", f"%e{k}", t, f"%tm{k}")
+            z, t = f"%z{k}", f"%t{k}"
+
+        yield f"ret {self.type} {z}"
 
 
 class LLVMGenerator(Generator):
-    def _binop(self, bits, v, cnst, expr):
+    options = {
+        "reduction": "auto",
+        "representation": "wide",
+        "window": "auto",
+        "lazy": True,
+        "batch": False,
+        "unroll": True,
+        "inline": "auto",
+        "profile": False,
+        "fixed": "auto",
+        "inversion": "safegcd",
+        "sqrt": False,
+    }
+
+    def _functions(self, limit):
+        "Picks the add, sub and mul functions for the options."
+        if self.representation == "wide":
+            return AddFunction(limit), SubFunction(limit), self._mul(limit)
+
+        if self.representation != "limbs":
+            rep = self.representation
+            raise ValueError(f"Unknown representation '{rep}'!")
+        if self.reduction not in ("auto", LimbMulFunction.reduction):
+            raise ValueError(f"Limbs do not support '{self.reduction}'!")
+
+        add = LimbAddFunction(limit)
+        sub = LimbSubFunction(limit)
+        return add, sub, LimbMulFunction(limit)
+
+    def _mul(self, limit):
+        "Picks the multiplication function for the reduction option."
+        if self.reduction == SerialMulFunction.reduction:
+            return SerialMulFunction(limit, unroll=self.unroll)
+        if self.reduction != "auto":
+            return MulFunction.find_reduction(self.reduction)(limit)
+
+        if SolinasMulFunction.shape(limit):
+            mul = SolinasMulFunction(limit)
+            if len(mul.folds) <= mul.maxfolds:
+                return mul
+
+        if limit % 2:
+            return MontgomeryMulFunction(limit)
+
+        return SerialMulFunction(limit, unroll=self.unroll)
+
+    def _lines(self, ctr, instructions):
+        "Numbers the instructions yielded by a generator. Returns its value."
+        x = None
+        while True:
+            try:
+                line = instructions.send(x)
+            except StopIteration as e:
+                return e.value
+
+            x = next(ctr)
+            yield f"    %{x} = {line}"
+
+    def _reduce(self, mul, bound, value):
+        """Emits the full reduction of a value, if its bound requires it.
+
+        Values without a bound are reduced. A value below 2 ^ m * limit is
+        reduced by conditionally subtracting limit * 2 ^ j, for each j < m.
+        """
+        t = mul.type
+        limit = mul.limit
+
+        m = (bound.get(value, 0) // limit).bit_length()
+        for j in range(m - 1, -1, -1):
+            x = yield f"sub {t} {value}, {limit << j}"
+            c = yield f"icmp ult {t} {value}, {limit << j}"
+            value = yield f"select i1 %{c}, {t} {value}, {t} %{x}"
+            value = f"%{value}"
+
+        return value
+
+    def _lazy(self, mul, bound, o, l, r):
+        """Emits an addition or subtraction without reducing the result.
+
+        A subtraction adds the least multiple of the limit that is at least
+        the bound of the subtrahend, so it cannot go negative. Operands are
+        reduced first if the result could overflow the type.
+        """
+        t = mul.type
+        limit = mul.limit
+        top = 1 << mul.bits
+
+        def size(l, r):
+            lb = bound.get(l, limit - 1)
+            rb = bound.get(r, limit - 1)
+            return lb + (rb if o == "+" else -(-rb // limit) * limit)
+
+        for x in sorted((l, r), key=lambda x: -bound.get(x, 0)):
+            if size(l, r) < top:
+                break
+            y = yield from self._reduce(mul, bound, x)
+            l, r = (y, r) if x == l else (l, y)
+
+        b = size(l, r)
+        if o == "+":
+            x = yield f"add {t} {l}, {r}"
+        else:
+            x = yield f"add {t} {l}, {b - bound.get(l, limit - 1)}"
+            x = yield f"sub {t} %{x}, {r}"
+
+        bound[f"%{x}"] = b
+        return f"%{x}"
+
+    def _binop(self, mul, v, raw, cnst, bound, expr):
+        """Emits an expression, returning its value in the mul domain.
+
+        With the lazy option, the value may not be reduced. Its bound is
+        then recorded in bound; _reduce() reduces it when needed.
+        """
         if isinstance(expr, int):
-            return f"{expr}"
+            return mul.const(mul.encode(expr))
         if isinstance(expr, str):
             try:
                 return v[expr]
@@ -135,57 +1546,481 @@ class LLVMGenerator(Generator):
                 return cnst[expr]
         elif isinstance(expr, list):
             l, o, r = expr
-            l = yield from self._binop(bits, v, cnst, l)
-            r = yield from self._binop(bits, v, cnst, r)
+            if o == MulFunction.op and l == r:
+                x = yield from self._binop(mul, v, raw, cnst, bound, l)
+                x = yield from self._reduce(mul, bound, x)
+                r = yield mul.call(SqrFunction.name, x)
+                return f"%{r}"
+
+            base = self._base(v, l) if o == ExpFunction.op else None
+            if base is not None:
+                r = yield from self._exponent(mul, v, raw, cnst, bound, r)
+                r = yield mul.call(self._fixed_exp(mul, base).name, r)
+                return f"%{r}"
+
+            l = yield from self._binop(mul, v, raw, cnst, bound, l)
+            if o == ExpFunction.op:
+                r = yield from self._exponent(mul, v, raw, cnst, bound, r)
+            else:
+                r = yield from self._binop(mul, v, raw, cnst, bound, r)
+
+            if o in "+-" and self.lazy and not mul.limbs:
+                return (yield from self._lazy(mul, bound, o, l, r))
+
+            if o == DivFunction.op and not mul.limit % 2:
+                raise ValueError("Division requires an odd limit!")
+
+            l = yield from self._reduce(mul, bound, l)
+            r = yield from self._reduce(mul, bound, r)
             n = Function.find_class(o).name
-            r = yield f"call i{bits} @{n}(i{bits} {l}, i{bits} {r})"
+            r = yield mul.call(n, l, r)
             return f"%{r}"
 
         assert False
 
+    def _base(self, v, expr):
+        "Returns the value of a constant base, if it gets a fixed-base table."
+        if self.fixed is False:
+            return None
+        if isinstance(expr, str) and expr not in v:
+            expr = self._constants.get(expr)
+        return expr if isinstance(expr, int) else None
+
+    def _fixed_exp(self, mul, base):
+        "Returns the fixed-base exponentiation helper of a base."
+        base %= mul.limit
+        if base not in self._fixed:
+            width = "auto" if self.fixed is True else self.fixed
+            name = f"exp.{len(self._fixed)}"
+            self._fixed[base] = FixedExpFunction(mul, base, name, width,
+                                                 self.unroll)
+        return self._fixed[base]
+
+    def _exponent(self, mul, v, raw, cnst, bound, expr):
+        "Emits an exponent. Exponents are integers, not field elements."
+        if isinstance(expr, int):
+            return mul.const(expr)
+        if isinstance(expr, str) and expr in raw:
+            return raw[expr]
+
+        x = yield from self._binop(mul, v, raw, cnst, bound, expr)
+        x = yield from self._reduce(mul, bound, x)
+        return (yield from mul.leave(x))
+
+    def _split(self, fn, value):
+        "Emits the conversion of a wide integer to the function's type."
+        if not fn.limbs:
+            return value
+
+        b = fn.bits
+        agg = "undef"
+        for i in range(fn.limbs):
+            x = yield f"lshr i{b} {value}, {64 * i}"
+            x = yield f"{cast(b, 64)} i{b} %{x} to i64"
+            agg = yield f"insertvalue {fn.type} {agg}, i64 %{x}, {i}"
+            agg = f"%{agg}"
+
+        return agg
+
+    def _join(self, fn, value):
+        "Emits the conversion of a value of the function's type to an integer."
+        if not fn.limbs:
+            return value
+
+        b = fn.bits
+        acc = "0"
+        for i in range(fn.limbs):
+            x = yield f"extractvalue {fn.type} {value}, {i}"
+            x = yield f"{cast(64, b)} i64 %{x} to i{b}"
+            x = yield f"shl i{b} %{x}, {64 * i}"
+            acc = yield f"or i{b} {acc}, %{x}"
+            acc = f"%{acc}"
+
+        return acc
+
+    def _batch(self, ast, function):
+        """Emits a loop applying a function to arrays of its arguments.
+
+        The loop is in canonical form (a counted induction variable and a
+        single latch), so LLVM can inline the call, unroll and vectorize.
+        Elements are util.bytes() apart, matching the C arrays.
+        """
+        size = util.bytes(ast["limit"])
+        t = f"i{util.bits(ast['limit'])}"
+        name = f"wht_{ast['name']}_{function['name']}"
+        prms = function["args"] + function["rets"]
+
+        args = ", ".join(f"{t}* %{n}" for n in prms)
+        yield f""
+        yield f"define void @{name}_batch(i64 %.n, {args}) {{"
+        yield f".entry:"
+        yield f"    %.empty = icmp eq i64 %.n, 0"
+        yield f"    br i1 %.empty, label %.done, label %.loop"
+        yield f".loop:"
+        yield f"    %.i = phi i64 [ 0, %.entry ], [ %.next, %.loop ]"
+        yield f"    %.o = mul nuw i64 %.i, {size}"
+        for n in prms:
+            yield f"    %{n}.b = bitcast {t}* %{n} to i8*"
+            yield f"    %{n}.o = getelementptr i8, i8* %{n}.b, i64 %.o"
+            yield f"    %{n}.p = bitcast i8* %{n}.o to {t}*"
+        args = ", ".join(f"{t}* %{n}.p" for n in prms)
+        yield f"    call void @{name}({args})"
+        yield f"    %.next = add nuw i64 %.i, 1"
+        yield f"    %.more = icmp ult i64 %.next, %.n"
+        yield f"    br i1 %.more, label %.loop, label %.done"
+        yield f".done:"
+        yield f"    ret void"
+        yield f"}}"
+
+    def _element(self, ast, array, index):
+        "Emits a pointer to array[index]. Elements are util.bytes() apart."
+        t = f"i{util.bits(ast['limit'])}"
+        o = yield f"mul nuw i64 {index}, {util.bytes(ast['limit'])}"
+        b = yield f"bitcast {t}* {array} to i8*"
+        p = yield f"getelementptr i8, i8* %{b}, i64 %{o}"
+        p = yield f"bitcast i8* %{p} to {t}*"
+        return f"%{p}"
+
+    def _nonzero(self, ast, mul, index):
+        """Emits x[index], with zero replaced by one, and whether it was zero.
+
+        Zero is the only value ORed with one, so this needs no select.
+        """
+        t = f"i{util.bits(ast['limit'])}"
+        p = yield from self._element(ast, "%x", index)
+        x = yield f"load {t}, {t}* {p}"
+        z = yield f"icmp eq {t} %{x}, 0"
+        m = yield f"sext i1 %{z} to {t}"
+        o = yield f"and {t} %{m}, {mul.encode(1)}"
+        x = yield f"or {t} %{x}, %{o}"
+        x = yield from self._split(mul, f"%{x}")
+        return x, f"%{m}"
+
+    def _batch_inv(self, ast, mul):
+        """Emits wht_NAME_batch_inv(), inverting the n elements of x into r.
+
+        This is Montgomery's trick: the products of the prefixes of x are
+        stored in r, and the inverse of the last one is then multiplied by
+        each prefix and each element on the way back. So it takes a single
+        inversion and three multiplications per element. r must not overlap
+        x.
+
+        The elements are never converted to the mul domain: as stored, they
+        stand for elements of the domain whose inverses differ from theirs
+        by a constant factor, which is applied once to the inverse. The
+        inverse of zero is zero, as with inv: zeros are multiplied in as
+        one and their results are masked.
+        """
+        limit = ast["limit"]
+        name = f"wht_{ast['name']}_batch_inv"
+        t = f"i{util.bits(limit)}"
+        one = mul.const(mul.encode(1))
+        scale = mul.const(mul.encode(inverse(mul.encode(1), limit) ** 2))
+        ctr = itertools.count()
+
+        yield f""
+        yield f"define void @{name}(i64 %.n, {t}* %x, {t}* %r) {{"
+        yield f".entry:"
+        yield f"    %.empty = icmp eq i64 %.n, 0"
+        yield f"    br i1 %.empty, label %.done, label %.fwd"
+
+        # r[i] = x[0] * ... * x[i]
+        yield f".fwd:"
+        yield f"    %.i = phi i64 [ 0, %.entry ], [ %.in, %.fwd ]"
+        yield f"    %.a = phi {mul.type} [ {one}, %.entry ], [ %.an, %.fwd ]"
+        x, z = yield from self._lines(ctr, self._nonzero(ast, mul, "%.i"))
+        yield f"    %.an = {mul.call(MulFunction.name, '%.a', x)}"
+        a = yield from self._lines(ctr, self._join(mul, "%.an"))
+        p = yield from self._lines(ctr, self._element(ast, "%r", "%.i"))
+        yield f"    store {t} {a}, {t}* {p}"
+        yield f"    %.in = add nuw i64 %.i, 1"
+        yield f"    %.fmore = icmp ult i64 %.in, %.n"
+        yield f"    br i1 %.fmore, label %.fwd, label %.inv"
+
+        yield f".inv:"
+        yield f"    %.s = {mul.call(InvFunction.name, '%.an')}"
+        yield f"    %.b0 = {mul.call(MulFunction.name, '%.s', scale)}"
+        yield f"    br label %.bwd"
+
+        # b = 1 / (x[0] * ... * x[k]), so r[k] = b * r[k - 1]
+        yield f".bwd:"
+        yield f"    %.j = phi i64 [ %.n, %.inv ], [ %.k, %.bwd ]"
+        yield f"    %.b = phi {mul.type} [ %.b0, %.inv ], [ %.bn, %.bwd ]"
+        yield f"    %.k = sub nuw i64 %.j, 1"
+        x, z = yield from self._lines(ctr, self._nonzero(ast, mul, "%.k"))
+        yield f"    %.first = icmp eq i64 %.k, 0"
+        yield f"    %.h = select i1 %.first, i64 1, i64 %.k"
+        yield f"    %.pk = sub nuw i64 %.h, 1"
+        p = yield from self._lines(ctr, self._element(ast, "%r", "%.pk"))
+        a = next(ctr)
+        yield f"    %{a} = load {t}, {t}* {p}"
+        a = yield from self._lines(ctr, self._split(mul, f"%{a}"))
+        yield f"    %.p = select i1 %.first, {mul.type} {one}, " \
+              f"{mul.type} {a}"
+        yield f"    %.y = {mul.call(MulFunction.name, '%.b', '%.p')}"
+        yield f"    %.bn = {mul.call(MulFunction.name, '%.b', x)}"
+        y = yield from self._lines(ctr, self._join(mul, "%.y"))
+        yield f"    %.nz = xor {t} {z}, -1"
+        yield f"    %.v = and {t} {y}, %.nz"
+        p = yield from self._lines(ctr, self._element(ast, "%r", "%.k"))
+        yield f"    store {t} %.v, {t}* {p}"
+        yield f"    %.bmore = icmp ne i64 %.k, 0"
+        yield f"    br i1 %.bmore, label %.bwd, label %.done"
+
+        yield f".done:"
+        yield f"    ret void"
+        yield f"}}"
+
+    def _policy(self, fn, body):
+        """Returns the attributes of a helper, with an inlining hint.
+
+        By the inline option, helpers of up to that many instructions are
+        always inlined and the others never are: "auto" inlines small
+        helpers like add and sub but keeps large ones like exp out of line.
+        True and False apply to all.
+        """
+        attrs = list(fn.attributes)
+        if self.profile:
+            # The counters are memory
+            attrs = [a for a in attrs if a not in ("readnone", "readonly")]
+
+        limit = self.inline
+        if limit == "auto":
+            limit = 200
+        elif limit is True:
+            return attrs + ["alwaysinline"]
+        elif limit is False:
+            return attrs + ["noinline"]
+        elif type(limit) is not int or limit < 0:
+            raise ValueError(f"Invalid inline '{limit}'!")
+
+        size = sum(1 for line in body if not line.endswith(":"))
+        return attrs + ["alwaysinline" if size <= limit else "noinline"]
+
+    def _reachable(self, code, helpers):
+        "Returns the names of the helpers called, directly or not, by code."
+        calls = {h.name: CALL.findall("\n".join(lines))
+                 for h, lines in helpers.items()}
+
+        found = set()
+        todo = CALL.findall("\n".join(code))
+        while todo:
+            name = todo.pop()
+            if name in calls and name not in found:
+                found.add(name)
+                todo += calls[name]
+
+        return found
+
+    def _profile(self, ast, index, lines):
+        """Returns the lines of a function, counting its calls and cycles.
+
+        The counters are entry index of the profile table. The cycles are
+        inclusive: those of a helper count again in its callers.
+        """
+        if not self.profile or self._profiled is None:
+            return lines
+
+        t = PROFILE
+        n = len(self._profiled)
+        data = f"[{n} x {t}]* @wht_{ast['name']}_profile_data"
+        calls = f"getelementptr inbounds ([{n} x {t}], {data}, " \
+                f"i32 0, i32 {index}, i32 1)"
+        cycles = calls[:-2] + "2)"
+
+        out = []
+        entry = True
+        for line in lines:
+            pad = line[:len(line) - len(line.lstrip())]
+            if line.lstrip().startswith("ret ") and self.profile == "cycles":
+                r = f"%.pr{len(out)}"
+                out.append(f"{pad}{r}.e = call i64 @llvm.readcyclecounter()")
+                out.append(f"{pad}{r}.d = sub i64 {r}.e, %.ps")
+                out.append(f"{pad}{r} = atomicrmw add i64* {cycles}, "
+                           f"i64 {r}.d monotonic")
+
+            out.append(line)
+            if entry and line.endswith("{"):
+                out.append(f"    %.pc = atomicrmw add i64* {calls}, "
+                           f"i64 1 monotonic")
+                if self.profile == "cycles":
+                    out.append(f"    %.ps = call i64 @llvm.readcyclecounter()")
+                entry = False
+
+        return out
+
+    def _table(self, ast):
+        "Emits the profile table and the functions reading and resetting it."
+        t = PROFILE
+        n = len(self._profiled)
+        data = f"@wht_{ast['name']}_profile_data"
+        entry = f"getelementptr inbounds ([{n} x {t}], [{n} x {t}]* {data}"
+
+        entries = []
+        for i, name in enumerate(self._profiled):
+            s = f"[{len(name) + 1} x i8]"
+            yield f"@.profile.{i} = private constant {s} c\"{name}\\00\""
+            name = f"getelementptr ({s}, {s}* @.profile.{i}, i32 0, i32 0)"
+            entries.append(f"{t} {{ i8* {name}, i64 0, i64 0 }}")
+
+        yield f"{data} = global [{n} x {t}] [{', '.join(entries)}]"
+        yield f""
+        yield f"define i64 @wht_{ast['name']}_profile({t}** %entries) {{"
+        yield f"    store {t}* {entry}, i32 0, i32 0), {t}** %entries"
+        yield f"    ret i64 {n}"
+        yield f"}}"
+        yield f""
+        yield f"define void @wht_{ast['name']}_profile_reset() {{"
+        for i in range(n):
+            yield f"    store i64 0, i64* {entry}, i32 0, i32 {i}, i32 1)"
+            yield f"    store i64 0, i64* {entry}, i32 0, i32 {i}, i32 2)"
+        yield f"    ret void"
+        yield f"}}"
+        yield f""
+        yield f"declare i64 @llvm.readcyclecounter()"
+
     def __call__(self, ast):
-        bits = util.bits(ast["limit"])
+        limit = ast["limit"]
+        symbols(ast, self.batch, self.sqrt, self.profile)
+        add, sub, mul = self._functions(limit)
+        exp = ExpFunction(limit, mul.encode(1), bool(mul.limbs), self.window,
+                          self.unroll)
 
-        yield from AddFunction(ast["limit"])()
-        yield from SubFunction(ast["limit"])()
-        yield from MulFunction(ast["limit"])()
-        yield from ExpFunction(ast["limit"])()
+        if self.profile not in (False, True, "cycles"):
+            raise ValueError(f"Invalid profile '{self.profile}'!")
+
+        inv = InvFunction.find_inversion(self.inversion)
+        fixed = self.fixed
+        if fixed not in ("auto", True, False):
+            if type(fixed) is not int or not 0 < fixed <= 8:
+                raise ValueError(f"Invalid fixed '{fixed}'!")
+
+        # Emit only the helpers that the functions need.
+        self._profiled = None
+        self._fixed = {}
+        code = list(self._module(ast, mul))
+        helpers = (add, sub, mul, SqrFunction(mul), exp)
+        helpers += tuple(self._fixed.values())
+        if limit % 2:
+            helpers += (inv(mul, self.unroll), DivFunction(mul))
+        if self.sqrt:
+            helpers += (SqrtFunction.find_shape(limit)(mul, self.unroll),)
+        helpers = {h: list(h(self._policy)) for h in helpers}
+        found = self._reachable(code, helpers)
+        helpers = {h: l for h, l in helpers.items() if h.name in found}
+
+        # With profile, the functions and then the helpers are counted.
+        # The table's size is only known now, so emit the functions again.
+        if self.profile:
+            self._profiled = [f"wht_{ast['name']}_{i['name']}"
+                              for i in ast["items"] if isinstance(i, dict)]
+            self._profiled += [h.name for h in helpers]
+
+            code = list(self._module(ast, mul))
+            for n, h in enumerate(helpers, len(self._profiled) - len(helpers)):
+                helpers[h] = self._profile(ast, n, helpers[h])
+
+            yield f"{PROFILE} = type {{ i8*, i64, i64 }}"
+            yield from self._table(ast)
+
+        for lines in helpers.values():
+            yield from lines
+        yield from code
+
+    def _module(self, ast, mul):
+        "Emits the constants and functions of the AST."
+        bits = util.bits(ast["limit"])
 
         cnst = {}
+        self._constants = {}
+        functions = [i for i in ast["items"] if isinstance(i, dict)]
         for i in sorted(ast["items"], key=lambda x: isinstance(x, dict)):
             if isinstance(i, list):
                 name = f"wht_{ast['name']}_{i[0]}"
                 cnst[i[0]] = f"@{name}"
+                self._constants[i[0]] = i[1]
                 yield f"@{name} = constant i{bits} {i[1]}"
 
             elif isinstance(i, dict):
-                v = {}
-                r = 0
-
-                args = [f"i{bits}* %{n}" for n in i['args'] + i['rets']]
-                args = ", ".join(args)
-                yield f""
-                yield f"define void @wht_{ast['name']}_{i['name']}({args}) {{"
-
-                for n in i['args']:
-                    r += 1
-                    yield f"    %{r} = load i{bits}, i{bits}* %{n}"
-                    v[n] = f"%{r}"
-
-                for n, e in i['body']:
-                    bo = self._binop(bits, v, cnst, e)
-                    x = None
-                    while True:
-                        try:
-                            line = bo.send(x)
-                            x = r = r + 1
-                            yield f"    %{r} = {line}"
-                        except StopIteration:
-                            v[n] = f"%{r}"
-                            break
-
-                for n in i['rets']:
-                    yield f"    store i{bits} {v[n]}, i{bits}* %{n}"
+                lines = list(self._function(ast, mul, cnst, i))
+                yield from self._profile(ast, functions.index(i), lines)
+
+                if self.batch:
+                    yield from self._batch(ast, i)
+
+        if self.batch and ast["limit"] % 2:
+            yield from self._batch_inv(ast, mul)
+
+        if self.sqrt:
+            yield from self._sqrt(ast, mul)
+
+    def _function(self, ast, mul, cnst, function):
+        "Emits a function of the AST."
+        bits = util.bits(ast["limit"])
+        ctr = itertools.count(1)
+        bound = {}
+        raw = {}
+        v = {}
+
+        args = [f"i{bits}* %{n}" for n in function['args'] + function['rets']]
+        args = ", ".join(args)
+        yield f""
+        yield f"define void @wht_{ast['name']}_{function['name']}({args}) {{"
+
+        for n in function['args']:
+            x = next(ctr)
+            yield f"    %{x} = load i{bits}, i{bits}* %{n}"
+            x = self._split(mul, f"%{x}")
+            raw[n] = yield from self._lines(ctr, x)
+            v[n] = yield from self._lines(ctr, mul.enter(raw[n]))
+
+        for n, e in function['body']:
+            bo = self._binop(mul, v, raw, cnst, bound, e)
+            v[n] = yield from self._lines(ctr, bo)
+
+        for n in function['rets']:
+            x = self._reduce(mul, bound, v[n])
+            x = yield from self._lines(ctr, x)
+            x = yield from self._lines(ctr, mul.leave(x))
+            x = yield from self._lines(ctr, self._join(mul, x))
+            yield f"    store i{bits} {x}, i{bits}* %{n}"
 
         yield "    ret void"
         yield "}"
+
+    def _sqrt(self, ast, mul):
+        """Emits wht_NAME_sqrt(), which returns whether x has a square root.
+
+        The root is stored in r, or zero if there is none. Whether it is a
+        root is checked by squaring it, and the result is masked rather
+        than branched on, so it is constant time.
+        """
+        t = f"i{util.bits(ast['limit'])}"
+        ctr = itertools.count(1)
+
+        yield f""
+        yield f"define i32 @wht_{ast['name']}_sqrt({t}* %x, {t}* %r) {{"
+        x = next(ctr)
+        yield f"    %{x} = load {t}, {t}* %x"
+        x = yield from self._lines(ctr, self._split(mul, f"%{x}"))
+        x = yield from self._lines(ctr, mul.enter(x))
+        r, ok = yield from self._lines(ctr, self._root(mul, t, x))
+        yield f"    store {t} {r}, {t}* %r"
+        ret = next(ctr)
+        yield f"    %{ret} = zext i1 {ok} to i32"
+        yield f"    ret i32 %{ret}"
+        yield "}"
+
+    def _root(self, mul, t, x):
+        "Emits the root of x (or zero) and whether it is one. See _sqrt()."
+        r = yield mul.call(SqrtFunction.name, x)
+        s = yield mul.call(SqrFunction.name, f"%{r}")
+        s = yield from self._join(mul, f"%{s}")
+        x = yield from self._join(mul, x)
+        ok = yield f"icmp eq {t} {s}, {x}"
+
+        r = yield from mul.leave(f"%{r}")
+        r = yield from self._join(mul, r)
+        m = yield f"sext i1 %{ok} to {t}"
+        r = yield f"and {t} {r}, %{m}"
+        return f"%{r}", f"%{ok}"
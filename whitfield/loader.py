@@ -0,0 +1,179 @@
+#
+# Copyright: 2017 Red Hat, Inc.
+# Author: Nathaniel McCallum <npmccallum@redhat.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+from . import ast
+from .cache import Cache, sources
+from .parser import parse
+from .opt import PassManager
+from .gen.llvm import LLVMGenerator
+from . import util
+import pkg_resources
+import subprocess
+import tempfile
+import ctypes
+import json
+import sys
+import os
+
+# The command building a shared object from LLVM IR
+CLANG = ("clang", "-O2", "-shared", "-fPIC", "-Wno-override-module")
+
+# Loaded libraries, by cache key
+_loaded = {}
+
+
+class Library:
+    """A compiled module, loaded into this process.
+
+    Each function of the module is a method taking field elements as ints.
+    It returns its result, or a tuple of them if it has several. Each
+    constant of the module is an int attribute. Module names never start
+    with an underscore, so the internals cannot clash with them.
+    """
+
+    def __init__(self, path, meta):
+        self._name = meta["name"]
+        self._limit = meta["limit"]
+        self._lib = ctypes.cdll.LoadLibrary(path)
+
+        for name, value in meta["constants"].items():
+            setattr(self, name, value)
+        for fn in meta["functions"]:
+            setattr(self, fn["name"], self._function(fn))
+
+    def _function(self, fn):
+        size = util.bytes(self._limit)
+        func = getattr(self._lib, f"wht_{self._name}_{fn['name']}")
+        nargs = len(fn["args"])
+        nrets = len(fn["rets"])
+
+        def call(*args):
+            if len(args) != nargs:
+                raise TypeError(f"{fn['name']}() takes {nargs} arguments "
+                                f"({len(args)} given)")
+
+            for a in args:
+                if not 0 <= a < self._limit:
+                    raise ValueError(f"{a} is not in the field!")
+
+            ins = [a.to_bytes(size, sys.byteorder) for a in args]
+            outs = [ctypes.create_string_buffer(size) for r in range(nrets)]
+            func(*ins, *outs)
+
+            rets = tuple(int.from_bytes(o.raw, sys.byteorder) for o in outs)
+            return rets[0] if nrets == 1 else rets
+
+        call.__name__ = fn["name"]
+        call.__doc__ = f"{fn['name']}({', '.join(fn['args'])}) -> " \
+                       f"{', '.join(fn['rets'])}"
+        return call
+
+
+def build(text, name, **options):
+    """Compiles a source to a shared object. Returns it and its metadata.
+
+    The metadata are the name, the limit, the constants and the signatures
+    of the functions, as JSON-compatible values.
+    """
+    assert ast.IDN.parseString(name)
+
+    tree = parse(text)
+    tree["name"] = name
+    eps = pkg_resources.iter_entry_points(group="whitfield.opt.Optimizer")
+    PassManager([ep.load() for ep in eps])(tree)
+
+    meta = {
+        "name": name,
+        "limit": tree["limit"],
+        "constants": {i[0]: i[1] for i in tree["items"]
+                      if isinstance(i, list)},
+        "functions": [{"name": i["name"], "args": i["args"],
+                       "rets": i["rets"]} for i in tree["items"]
+                      if isinstance(i, dict)],
+    }
+
+    with tempfile.TemporaryDirectory(prefix="whitfield") as tmp:
+        src = os.path.join(tmp, f"{name}.ll")
+        lib = os.path.join(tmp, f"lib{name}.so")
+        with open(src, "w") as f:
+            for line in LLVMGenerator(**options)(tree):
+                f.write(line + "\n")
+
+        subprocess.run(CLANG + ("-o", lib, src), check=True)
+        with open(lib, "rb") as f:
+            return f.read(), meta
+
+
+def load(src, name=None, cache=None, **options):
+    """Compiles a module and loads it into this process.
+
+    The source is either the path of a .wht file or the text of one. Its
+    name defaults to that of the file ("wht" for text). The options are
+    given to the LLVM generator. Imports are resolved like the compiler
+    does, from the current directory.
+
+    The shared object is cached on disk, by default in $WHITFIELD_CACHE or
+    else ~/.cache/whitfield. It is keyed by the contents of the source and
+    of its imports, so an unchanged module is never compiled again. Within
+    a process, loading it again returns the same Library.
+    """
+    if os.path.isfile(src):
+        if name is None:
+            name = os.path.basename(src).split(".", 1)[0]
+        with open(src) as f:
+            src = f.read()
+
+    if cache is None:
+        cache = os.environ.get("WHITFIELD_CACHE")
+    if cache is None:
+        home = os.environ.get("XDG_CACHE_HOME", "~/.cache")
+        cache = os.path.join(os.path.expanduser(home), "whitfield")
+    cache = Cache(cache)
+
+    # The imports of the source; they are part of the key.
+    imports = set()
+    for tokens, start, end in ast.IMP.scanString(src):
+        imports.update(sources(f"{tokens[0]}.wht"))
+
+    name = "wht" if name is None else name
+    eps = pkg_resources.iter_entry_points(group="whitfield.opt.Optimizer")
+    plugins = sorted(str(ep) + f" ({ep.dist})" for ep in eps)
+    key = cache.key(None, src.encode(), sorted(imports), name, plugins,
+                    sorted(options.items()), CLANG)
+
+    if key in _loaded:
+        return _loaded[key]
+
+    # Entries are the metadata (as JSON), a NUL, then the shared object.
+    data = cache.get(key)
+    if data is None:
+        lib, meta = build(src, name, **options)
+        data = json.dumps(meta).encode() + b"\0" + lib
+        cache.put(key, data)
+
+    meta, lib = data.split(b"\0", 1)
+    with tempfile.NamedTemporaryFile(prefix="lib", suffix=".so") as f:
+        f.write(lib)
+        f.flush()
+        _loaded[key] = Library(f.name, json.loads(meta))
+
+    return _loaded[key]
@@ -20,25 +20,179 @@
 # under the License.
 #
 
-def ops(limit=None):
-    def exp(l, r):
-        a = l
-        b = 1
+import functools
+
 
-        for o in range(r.bit_length(), -1, -1):
-            if r & (1 << o):
-                b = (b * a) % limit
-                a = (a * a) % limit
-            else:
-                a = (a * b) % limit
-                b = (b * b) % limit
+@functools.lru_cache(maxsize=None)
+def ops(limit=None):
+    """Returns the operators, as functions, of the field with the limit.
 
-        return b
+    Without a limit, they are the integer operators. The result is cached.
+    As at runtime, dividing by zero in the field gives zero.
+    """
+    if not limit:
+        return {
+            "@": lambda l, r: l ** r,
+            "*": lambda l, r: l * r,
+            "/": lambda l, r: l // r,
+            "+": lambda l, r: l + r,
+            "-": lambda l, r: l - r,
+        }
 
     return {
-        "@": exp if limit else lambda l, r: l ** r,
-        "*": lambda l, r: (l * r) % limit if limit else l * r,
-        "/": lambda l, r: (l // r) % limit if limit else l // r,
-        "+": lambda l, r: (l + r) % limit if limit else l + r,
-        "-": lambda l, r: (l - r) % limit if limit else l - r,
+        "@": lambda l, r: pow(l, r, limit),
+        "*": lambda l, r: (l * r) % limit,
+        "/": lambda l, r: l * inverse(r, limit) % limit if r % limit else 0,
+        "+": lambda l, r: (l + r) % limit,
+        "-": lambda l, r: (l - r) % limit,
     }
+
+
+def inverse(value, modulus):
+    "Returns the multiplicative inverse of value modulo modulus."
+    a, b = value % modulus, modulus
+    x, y = 1, 0
+
+    while b:
+        q = a // b
+        a, b = b, a - q * b
+        x, y = y, x - q * y
+
+    if a != 1:
+        raise ValueError(f"{value} is not invertible modulo {modulus}!")
+
+    return x % modulus
+
+
+def naf(value):
+    "Returns the non-adjacent form of value as a list of (sign, exponent)."
+    terms = []
+    e = 0
+
+    while value:
+        if value & 1:
+            z = 2 - (value & 3)
+            terms.append((z, e))
+            value -= z
+        value >>= 1
+        e += 1
+
+    return terms
+
+
+class _Chain:
+    "An addition chain under construction. Element 0 is 1."
+
+    def __init__(self):
+        self.exps = [1]
+        self.steps = []
+
+    def add(self, i, j):
+        self.exps.append(self.exps[i] + self.exps[j])
+        self.steps.append((i, j))
+        return len(self.exps) - 1
+
+    def double(self, i, n):
+        for _ in range(n):
+            i = self.add(i, i)
+        return i
+
+
+def _sliding(exponent, k):
+    "Sliding window method with windows of up to k bits."
+    c = _Chain()
+
+    # Split the exponent into zeros and odd windows of up to k bits.
+    bits = bin(exponent)[2:]
+    windows = []
+    i = 0
+    while i < len(bits):
+        j = i + 1
+        if bits[i] == "1":
+            j = min(i + k, len(bits))
+            while bits[j - 1] == "0":
+                j -= 1
+        windows.append((j - i, int(bits[i:j], 2)))
+        i = j
+
+    # Odd powers up to the largest window
+    odd = {1: 0}
+    top = max(w for n, w in windows)
+    if top > 1:
+        sq = c.add(0, 0)
+        for e in range(3, top + 1, 2):
+            odd[e] = c.add(odd[e - 2], sq)
+
+    acc = odd[windows[0][1]]
+    for n, w in windows[1:]:
+        acc = c.double(acc, n)
+        if w:
+            acc = c.add(acc, odd[w])
+
+    return c.steps
+
+
+def _runs(exponent):
+    """Method of runs: builds 2 ^ n - 1 for each run of n ones.
+
+    This suits exponents such as p - 2 for special primes, which are mostly
+    long runs of ones. The run lengths are themselves built with a chain,
+    since 2 ^ (a + b) - 1 = (2 ^ a - 1) * 2 ^ b + 2 ^ b - 1.
+    """
+    c = _Chain()
+    ones = {1: 0}   # Run length -> element index
+
+    def run(n):
+        if n not in ones:
+            lens = [1]
+            for i, j in chain(n):
+                a, b = sorted((lens[i], lens[j]), reverse=True)
+                lens.append(a + b)
+                if a + b not in ones:
+                    x = c.double(run(a), b)
+                    ones[a + b] = c.add(x, run(b))
+        return ones[n]
+
+    # Split the exponent into alternating runs of ones and zeros.
+    bits = bin(exponent)[2:]
+    runs = []
+    for b in bits:
+        if runs and runs[-1][0] == b:
+            runs[-1][1] += 1
+        else:
+            runs.append([b, 1])
+
+    acc = None
+    for b, n in runs:
+        if b == "0":
+            acc = c.double(acc, n)
+        elif acc is None:
+            acc = run(n)
+        else:
+            acc = c.add(c.double(acc, n), run(n))
+
+    return c.steps
+
+
+def chain(exponent):
+    """Returns a short addition chain for exponent (> 1).
+
+    The chain is a list of (i, j) pairs: element n + 1 is the sum of
+    elements i and j, where element 0 is 1 and the last element is the
+    exponent. The shortest result of the sliding window method (for each
+    window width) and the method of runs is used.
+    """
+    if exponent < 2:
+        raise ValueError("Addition chains start at 2!")
+
+    steps = [_sliding(exponent, k) for k in range(1, 9)]
+    return min(steps + [_runs(exponent)], key=len)
+
+
+def nonresidue(modulus):
+    "Returns the least quadratic non-residue modulo an odd prime modulus."
+    for z in range(2, modulus):
+        if pow(z, (modulus - 1) // 2, modulus) == modulus - 1:
+            return z
+
+    raise ValueError(f"{modulus} has no quadratic non-residue!")
@@ -21,32 +21,17 @@
 #
 
 import abc
-import functools
+import copy
+import heapq
+import time
 
 
-@functools.total_ordering
 class Optimizer(abc.ABC):
+    options = ()  # Keyword arguments taken, from those of the PassManager
+
     _before = set()
     _after = set()
-
-    def __lt__(self, other):
-        def lt(a, b):
-            for x in b._after:
-                if lt(a, x):
-                    return True
-            return b in a._before
-        return lt(self.__class__, other.__class__)
-
-    def __eq__(self, other):
-        return not self < other and not self > other
-
-    def __gt__(self, other):
-        def gt(a, b):
-            for x in b._before:
-                if gt(a, x):
-                    return True
-            return b in a._after
-        return gt(self.__class__, other.__class__)
+    _group = None
 
     @abc.abstractmethod
     def __call__(self, ast):
@@ -70,3 +55,123 @@ def before(*args):
             arg._after = arg._after.union((cls,))
         return cls
     return inner
+
+
+def group(name):
+    """Puts an optimizer in a group, which is repeated to a fixed point.
+
+    The optimizers of a group run one after the other, and then run again
+    for as long as they change the AST.
+    """
+    def inner(cls):
+        cls._group = name
+        return cls
+    return inner
+
+
+def size(ast):
+    "Returns the number of operations in the functions of the AST."
+    def ops(expr):
+        if isinstance(expr, list):
+            return 1 + ops(expr[0]) + ops(expr[2])
+        return 0
+
+    return sum(ops(e) for i in ast["items"] if isinstance(i, dict)
+               for n, e in i["body"])
+
+
+def schedule(nodes, edges):
+    """Sorts the nodes topologically. Edges map each node to its successors.
+
+    Nodes that are not ordered by the edges keep their order. Raises a
+    ValueError naming the nodes of a cycle, if there is one.
+    """
+    preds = {n: {m for m in nodes if n in edges.get(m, ())} for n in nodes}
+    ready = [i for i, n in enumerate(nodes) if not preds[n]]
+    order = []
+
+    heapq.heapify(ready)
+    while ready:
+        n = nodes[heapq.heappop(ready)]
+        order.append(n)
+        for m in edges.get(n, ()):
+            preds[m].discard(n)
+            if not preds[m]:
+                heapq.heappush(ready, nodes.index(m))
+
+    if len(order) < len(nodes):
+        # Each node left has a predecessor left: walk back to a repeat.
+        cycle = [next(n for n in nodes if preds[n])]
+        while cycle.count(cycle[-1]) < 2:
+            cycle.append(min(preds[cycle[-1]], key=nodes.index))
+        cycle = cycle[cycle.index(cycle[-1]):][::-1]
+        names = " -> ".join(getattr(n, "__name__", str(n))
+                            for n in cycle)
+        raise ValueError(f"Optimizers have a cycle: {names}!")
+
+    return order
+
+
+class PassManager:
+    """Runs the optimizers in the order their @after and @before require.
+
+    The optimizers of a group (see group()) are scheduled as one pass and
+    run to a fixed point, or at most limit times. If timed, a record of the
+    time taken and the size of the AST before and after each run is kept in
+    the records attribute. The other options are given to the optimizers
+    that take them (see Optimizer.options).
+    """
+
+    limit = 10  # Most runs of a group
+
+    def __init__(self, optimizers, timed=False, **options):
+        optimizers = list(optimizers)
+        self.timed = timed
+        self.records = []
+
+        # Ordering constraints between groups apply to the whole group.
+        node = {o: o._group or o for o in optimizers}
+        nodes = list(dict.fromkeys(node.values()))
+        edges = {}
+        for o in optimizers:
+            for a in o._after:
+                if a in node and node[a] != node[o]:
+                    edges.setdefault(node[a], set()).add(node[o])
+
+        self.passes = []
+        for n in schedule(nodes, edges):
+            group = [o for o in optimizers if node[o] == n]
+            inner = {a: {o for o in group if a in o._after} for a in group}
+            opts = [o(**{k: v for k, v in options.items() if k in o.options})
+                    for o in schedule(group, inner)]
+            self.passes.append((isinstance(n, str), opts))
+
+    def _run(self, opt, ast, run):
+        if not self.timed:
+            return opt(ast)
+
+        before = size(ast)
+        start = time.perf_counter()
+        opt(ast)
+        seconds = time.perf_counter() - start
+        self.records.append((type(opt).__name__, run, seconds,
+                             before, size(ast)))
+
+    def __call__(self, ast):
+        "Optimizes the AST (in place)."
+        for repeat, opts in self.passes:
+            for run in range(1, self.limit + 1 if repeat else 2):
+                old = copy.deepcopy(ast) if repeat else None
+                for opt in opts:
+                    self._run(opt, ast, run)
+                if ast == old:
+                    break
+
+    def report(self):
+        "Yields the lines of a table of the records."
+        yield f"{'seconds':>10} {'before':>8} {'after':>8}  pass"
+        for name, run, seconds, before, after in self.records:
+            name += f" ({run})" if run > 1 else ""
+            yield f"{seconds:10.6f} {before:8} {after:8}  {name}"
+        total = sum(r[2] for r in self.records)
+        yield f"{total:10.6f} {'':8} {'':8}  total"
@@ -0,0 +1,80 @@
+#
+# Copyright: 2017 Red Hat, Inc.
+# Author: Nathaniel McCallum <npmccallum@redhat.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+from . import Optimizer, after
+from .condenser import Simplifier
+from ..math import chain
+import itertools
+
+
+@after(Simplifier)
+class AdditionChain(Optimizer):
+    "Replaces exponentiation by compile-time exponents with addition chains."
+
+    def _rewrite(self, expr, body, names):
+        if not isinstance(expr, list):
+            return expr
+
+        l, o, r = expr
+        l = self._rewrite(l, body, names)
+        r = self._rewrite(r, body, names)
+        if o != "@" or not isinstance(r, int) or isinstance(l, int):
+            return [l, o, r]
+
+        if r == 0:
+            return 1
+        if r == 1:
+            return l
+
+        # The base is used many times, so compute it only once.
+        if not isinstance(l, str):
+            n = next(names)
+            body.append([n, l])
+            l = n
+
+        vals = [l]
+        for i, j in chain(r):
+            n = next(names)
+            body.append([n, [vals[i], "*", vals[j]]])
+            vals.append(n)
+
+        return vals[-1]
+
+    def __call__(self, ast):
+        for i in ast["items"]:
+            if not isinstance(i, dict):
+                continue
+
+            names = (f"_ac{n}" for n in itertools.count())
+            body = []
+
+            for n, e in i["body"]:
+                e = self._rewrite(e, body, names)
+
+                # Assign the chain's last step directly, rather than copying.
+                if isinstance(e, str) and e.startswith("_ac"):
+                    if body and body[-1][0] == e:
+                        e = body.pop()[1]
+
+                body.append([n, e])
+
+            i["body"] = body
@@ -22,8 +22,8 @@
 
 from . import Optimizer, after
 from . import importer
-from ..math import ops
-from itertools import chain
+from ..math import inverse, ops
+from itertools import chain, count
 
 
 def compile_time_math(expr, ops, constants={}):
@@ -105,3 +105,174 @@ class FunctionCondenser(Optimizer):
 
             i["body"] = [x for x in i["body"]
                          if not isinstance(x[1], int) or x[0] in i["rets"]]
+
+
+def terms(expr, sign=1):
+    "Yields the (sign, term) pairs of a sum (or difference)."
+    if isinstance(expr, list) and expr[1] in "+-":
+        yield from terms(expr[0], sign)
+        yield from terms(expr[2], sign if expr[1] == "+" else -sign)
+    else:
+        yield sign, expr
+
+
+def factors(expr):
+    "Yields the factors of a product."
+    if isinstance(expr, list) and expr[1] == "*":
+        yield from factors(expr[0])
+        yield from factors(expr[2])
+    else:
+        yield expr
+
+
+def multiple(expr, n, bind):
+    """Returns expr * n as additions (doubling and adding, like an exponent).
+
+    Operands that are used twice are given to bind() if they are compound.
+    It returns a name assigned to them, so they are only computed once.
+    """
+    expr = acc = bind(expr) if isinstance(expr, list) else expr
+    for bit in bin(n)[3:]:
+        if isinstance(acc, list):
+            acc = bind(acc)
+        acc = [acc, "+", acc]
+        if bit == "1":
+            acc = [acc, "+", expr]
+    return acc
+
+
+@after(FunctionCondenser)
+class Simplifier(Optimizer):
+    """Applies algebraic identities and strength reductions in functions.
+
+    Constants in sums and products are gathered and folded, terms that
+    cancel are dropped and identities (x * 1, x * 0, x + 0, x @ 0, x @ 1)
+    are removed. Division by a constant becomes multiplication by its
+    inverse (or zero, for zero), and multiplication by a small constant (or
+    by the negation of one) becomes a few additions. Compound operands of
+    those additions are assigned to new names first. Assignments that
+    become constants are propagated, like the FunctionCondenser does.
+    """
+
+    maxadds = 4  # Most additions to replace a multiplication by a constant
+
+    def _sum(self, expr, limit):
+        ts = list(terms(expr))
+        const = sum(s * t for s, t in ts if isinstance(t, int)) % limit
+        ts = [(s, t) for s, t in ts if not isinstance(t, int)]
+
+        # Drop the terms that cancel.
+        for s, t in list(ts):
+            if (s, t) in ts and (-s, t) in ts:
+                ts.remove((s, t))
+                ts.remove((-s, t))
+
+        if len(ts) == len(list(terms(expr))):
+            return expr
+
+        # Rebuild the sum, starting with a term that is added.
+        ts.sort(key=lambda st: st[0] < 0)
+        acc = None
+        for s, t in ts:
+            if acc is None:
+                acc = t if s > 0 else [const, "-", t]
+                const = 0 if s < 0 else const
+            else:
+                acc = [acc, "+" if s > 0 else "-", t]
+
+        if acc is None:
+            return const
+        if const == 0:
+            return acc
+        if const <= limit // 2:
+            return [acc, "+", const]
+        return [acc, "-", limit - const]
+
+    def _product(self, expr, limit):
+        fs = list(factors(expr))
+        const = 1
+        for f in fs:
+            if isinstance(f, int):
+                const = const * f % limit
+
+        fs = [f for f in fs if not isinstance(f, int)]
+        if len(fs) == len(list(factors(expr))):
+            return expr
+        if const == 0 or not fs:
+            return const
+
+        acc = fs[0]
+        for f in fs[1:]:
+            acc = [acc, "*", f]
+
+        def adds(n):
+            return n.bit_length() + bin(n).count("1") - 2
+
+        if const == 1:
+            return acc
+        if adds(const) <= self.maxadds:
+            return multiple(acc, const, self._bind)
+        if adds(limit - const) <= self.maxadds:
+            return [0, "-", multiple(acc, limit - const, self._bind)]
+        return [acc, "*", const]
+
+    def simplify(self, expr, limit):
+        "Returns the simplified expression."
+        if not isinstance(expr, list):
+            return expr
+
+        l, o, r = expr
+        l = self.simplify(l, limit)
+        r = self.simplify(r, limit)
+        if isinstance(l, int) and isinstance(r, int):
+            return ops(limit)[o](l, r)
+
+        if o in "+-":
+            return self._sum([l, o, r], limit)
+        if o == "*":
+            return self._product([l, o, r], limit)
+        if o == "@" and (r == 0 or l == 1):
+            return 1
+        if o == "@" and r == 1:
+            return l
+        if o == "/" and isinstance(r, int) and not r % limit:
+            return 0  # As the inverse of zero is zero
+        if o == "/" and isinstance(r, int):
+            return self._product([l, "*", inverse(r, limit)], limit)
+
+        # (x @ a) @ b = x @ (a * b), if the exponent stays in range.
+        if o == "@" and isinstance(r, int) and isinstance(l, list):
+            if l[1] == "@" and isinstance(l[2], int) and l[2] * r < limit:
+                return [l[0], "@", l[2] * r]
+
+        return [l, o, r]
+
+    def __call__(self, ast):
+        for i in ast["items"]:
+            if not isinstance(i, dict):
+                continue
+
+            v = {}  # Compile-time values
+            body = []
+
+            used = {n for n, e in i["body"]}
+            names = (f"_m{k}" for k in count()
+                     if f"_m{k}" not in used)
+
+            def bind(expr):
+                n = next(names)
+                body.append([n, expr])
+                return n
+
+            self._bind = bind
+            for n, e in i["body"]:
+                e = compile_time_math(e, ops(ast["limit"]), v)
+                e = self.simplify(e, ast["limit"])
+                v.pop(n, None)
+
+                if isinstance(e, int) and n not in i["rets"]:
+                    v[n] = e
+                else:
+                    body.append([n, e])
+
+            i["body"] = body
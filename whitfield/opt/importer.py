@@ -21,19 +21,77 @@
 #
 
 from . import Optimizer
-from ..ast import BDY
+from .. import VERSION
+from ..parser import parse_body
+from ..cache import Cache
+import functools
+import hashlib
+import json
+import copy
+import os
+
+
+@functools.lru_cache(maxsize=256)
+def _parsed(key, cache):
+    """Returns the items of a module, by (resolved path, mtime, size).
+
+    The most recently used modules are kept, so each is parsed once per
+    process until it changes. If a cache directory is given, the items are
+    also stored there, for later processes.
+    """
+    with open(key[0], "rb") as f:
+        data = f.read()
+
+    if cache:
+        cache = Cache(cache)
+        hkey = hashlib.sha256(repr(VERSION).encode() + data).hexdigest()
+        items = cache.get(hkey)
+        if items is not None:
+            return json.loads(items)
+
+    items = parse_body(data.decode("utf8"))
+
+    if cache:
+        cache.put(hkey, json.dumps(items).encode())
+
+    return items
 
 
 class Importer(Optimizer):
-    "Performs replacement of all import statements with their file contents."
+    """Performs replacement of all import statements with their file contents.
+
+    Imports are replaced recursively, and each module is included only once.
+    Modules are parsed once per process (until they change), keeping the
+    most recently used ones. If a cache directory is given (by default
+    $WHITFIELD_CACHE), the parsed modules are also stored there, so they
+    are not parsed again by later runs.
+    """
+
+    options = ("cache",)
+
+    def __init__(self, cache=None):
+        if cache is None:
+            cache = os.environ.get("WHITFIELD_CACHE")
+        self.cache = os.path.join(cache, "modules") if cache else None
+
+    def parse(self, path):
+        "Returns the items of a module. Each call returns a new copy."
+        st = os.stat(path)
+        key = (os.path.realpath(path), st.st_mtime_ns, st.st_size)
+        return copy.deepcopy(_parsed(key, self.cache))
 
     def __call__(self, ast):
-        body = []
+        seen = set()
+
+        def expand(items):
+            for item in items:
+                if not isinstance(item, str):
+                    yield item
+                    continue
 
-        for item in ast["items"]:
-            if isinstance(item, str):
-                body += BDY.parseFile(f"{item}.wht", True).asList()[0]
-            else:
-                body.append(item)
+                path = os.path.realpath(f"{item}.wht")
+                if path not in seen:
+                    seen.add(path)
+                    yield from expand(self.parse(path))
 
-        ast["items"] = body
+        ast["items"] = list(expand(ast["items"]))
@@ -0,0 +1,237 @@
+#
+# Copyright: 2017 Red Hat, Inc.
+# Author: Nathaniel McCallum <npmccallum@redhat.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+from . import Optimizer, after, group
+from .chain import AdditionChain
+from collections import Counter
+import itertools
+
+COMMUTATIVE = {"+", "*"}
+
+
+def uses(expr):
+    "Returns the set of names used by an expression."
+    if isinstance(expr, str):
+        return {expr}
+    if isinstance(expr, list):
+        return uses(expr[0]) | uses(expr[2])
+    return set()
+
+
+def substitute(expr, names):
+    "Returns the expression with names replaced using a mapping."
+    if isinstance(expr, str):
+        return names.get(expr, expr)
+    if isinstance(expr, list):
+        l, o, r = expr
+        return [substitute(l, names), o, substitute(r, names)]
+    return expr
+
+
+def key(expr):
+    "Returns a hashable key, equal for equal expressions."
+    if not isinstance(expr, list):
+        return expr
+
+    l, o, r = key(expr[0]), expr[1], key(expr[2])
+    if o in COMMUTATIVE:
+        l, r = sorted((l, r), key=repr)
+    return (l, o, r)
+
+
+def fresh(function, prefix):
+    "Yields names with the given prefix that the function doesn't use."
+    used = set(function["args"]) | set(function["rets"])
+    for n, e in function["body"]:
+        used |= {n} | uses(e)
+
+    for i in itertools.count():
+        if f"{prefix}{i}" not in used:
+            yield f"{prefix}{i}"
+
+
+def ssa(function):
+    """Renames all but the last assignment to each name.
+
+    Afterwards every name is assigned once, so a name stands for one value.
+    The last assignment keeps its name, which keeps the return values.
+    """
+    left = Counter(n for n, e in function["body"])
+    names = fresh(function, "_s")
+    current = {}
+    body = []
+
+    for n, e in function["body"]:
+        e = substitute(e, current)
+        left[n] -= 1
+        if left[n] > 0:
+            current[n] = next(names)
+        else:
+            current.pop(n, None)
+        body.append([current.get(n, n), e])
+
+    function["body"] = body
+
+
+def functions(ast):
+    "Yields each function of the AST, in SSA form."
+    for i in ast["items"]:
+        if isinstance(i, dict):
+            ssa(i)
+            yield i
+
+
+@after(AdditionChain)
+class Squarer(Optimizer):
+    """Rewrites squares (x @ 2 and x * x) so they multiply a name by itself.
+
+    The generators emit a dedicated squaring for these. A compound operand
+    is hoisted into a new name, so it is also computed only once.
+    """
+
+    def __call__(self, ast):
+        for f in functions(ast):
+            names = fresh(f, "_sq")
+            body = []
+
+            def rewrite(expr):
+                if not isinstance(expr, list):
+                    return expr
+
+                l, o, r = expr
+                l, r = rewrite(l), rewrite(r)
+                if o == "@" and r == 2:
+                    r = l
+                elif o != "*" or key(l) != key(r):
+                    return [l, o, r]
+
+                if isinstance(l, list):
+                    n = next(names)
+                    body.append([n, l])
+                    l = n
+
+                return [l, "*", l]
+
+            for n, e in f["body"]:
+                body.append([n, rewrite(e)])
+
+            f["body"] = body
+
+
+@after(Squarer)
+@group("cleanup")
+class CommonSubexpressionEliminator(Optimizer):
+    "Computes each repeated expression (or subexpression) only once."
+
+    def __call__(self, ast):
+        for f in functions(ast):
+            count = Counter()
+
+            def walk(expr):
+                if isinstance(expr, list):
+                    count[key(expr)] += 1
+                    walk(expr[0])
+                    walk(expr[2])
+
+            for n, e in f["body"]:
+                walk(e)
+
+            names = fresh(f, "_cse")
+            avail = {}
+            body = []
+
+            def rewrite(expr, top=False):
+                if not isinstance(expr, list):
+                    return expr
+
+                k = key(expr)
+                if k in avail:
+                    return avail[k]
+
+                l, o, r = expr
+                expr = [rewrite(l), o, rewrite(r)]
+
+                # Hoist repeated subexpressions into a new name.
+                if not top and count[k] > 1:
+                    avail[k] = next(names)
+                    body.append([avail[k], expr])
+                    return avail[k]
+
+                return expr
+
+            for n, e in f["body"]:
+                body.append([n, rewrite(e, True)])
+                if isinstance(e, list):
+                    avail.setdefault(key(e), n)
+
+            f["body"] = body
+
+
+@after(CommonSubexpressionEliminator)
+@group("cleanup")
+class CopyPropagator(Optimizer):
+    "Replaces names assigned a copy (a = b or a = 1) with what they copy."
+
+    def __call__(self, ast):
+        for f in functions(ast):
+            copies = {}
+            body = []
+
+            # A return value that copies a temporary takes over its name.
+            temps = {n for n, e in f["body"]} - set(f["rets"])
+            for n, e in f["body"]:
+                if n in f["rets"] and isinstance(e, str) and e in temps:
+                    copies.setdefault(e, n)
+
+            for n, e in f["body"]:
+                n = copies.get(n, n)
+                e = substitute(e, copies)
+                if n == e:
+                    continue
+                elif isinstance(e, list) or n in f["rets"]:
+                    body.append([n, e])
+                else:
+                    copies[n] = e
+
+            f["body"] = body
+
+
+@after(CopyPropagator)
+@group("cleanup")
+class DeadCodeEliminator(Optimizer):
+    "Removes assignments whose values never reach a return value."
+
+    def __call__(self, ast):
+        for i in ast["items"]:
+            if not isinstance(i, dict):
+                continue
+
+            live = set(i["rets"])
+            body = []
+
+            for n, e in reversed(i["body"]):
+                if n in live:
+                    live.discard(n)
+                    live |= uses(e)
+                    body.append([n, e])
+
+            i["body"] = body[::-1]
@@ -0,0 +1,213 @@
+#
+# Copyright: 2017 Red Hat, Inc.
+# Author: Nathaniel McCallum <npmccallum@redhat.com>
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""A fast parser for the language, producing the same AST as ast.WHT.
+
+The grammar in whitfield.ast is the reference. This parser splits the
+source into tokens with a single regular expression and then parses
+expressions by precedence climbing, which is much faster than pyparsing's
+infixNotation. Tokens follow the reference grammar: numbers may contain
+whitespace ("1 234") and import paths are lexed as a whole.
+"""
+
+import re
+
+# Binding power and associativity of each operator
+OPS = {
+    "@": (3, True),
+    "*": (2, False),
+    "/": (2, False),
+    "+": (1, False),
+    "-": (1, False),
+}
+
+TOKENS = re.compile(r"""
+    (?P<ws>[ \t\n\r]+)
+  | import[ \t\n\r]*(?P<imp>[a-zA-Z0-9/._-]+[a-zA-Z0-9_-])[ \t\n\r]*;
+  | 0x[ \t\n\r]*(?P<hex>[0-9a-fA-F][0-9a-fA-F \t\n]*)
+  | (?P<dec>[0-9][0-9 \t\n]*)
+  | (?P<idn>[a-zA-Z][a-zA-Z0-9_]*)
+  | (?P<op>[-@*/+=;(),{}])
+  | (?P<err>.)
+""", re.VERBOSE | re.DOTALL)
+
+
+class ParseError(ValueError):
+    "Raised on invalid input, with the line and column of the error."
+
+    def __init__(self, text, pos, msg):
+        line = text.count("\n", 0, pos) + 1
+        col = pos - text.rfind("\n", 0, pos)
+        super().__init__(f"{msg} (at line {line}, column {col})")
+        self.line = line
+        self.col = col
+
+
+def tokenize(text):
+    """Returns the tokens of the text as (kind, value, position) tuples.
+
+    The kind is "imp", "num" or "idn", or else the operator or punctuation
+    itself. The list ends with an "end" token.
+    """
+    tokens = []
+    append = tokens.append
+
+    for m in TOKENS.finditer(text):
+        kind = m.lastgroup
+        if kind == "ws":
+            continue
+        elif kind == "op":
+            append((m.group(kind), None, m.start()))
+        elif kind == "idn":
+            append(("idn", m.group(kind), m.start()))
+        elif kind == "dec":
+            append(("num", int("".join(m.group(kind).split())), m.start()))
+        elif kind == "hex":
+            append(("num", int("".join(m.group(kind).split()), 16),
+                    m.start()))
+        elif kind == "imp":
+            append(("imp", m.group(kind), m.start()))
+        else:
+            raise ParseError(text, m.start(), f"Unexpected {m.group()!r}")
+
+    append(("end", None, len(text)))
+    return tokens
+
+
+class Parser:
+    "Parses a list of tokens. Each method parses one rule of the grammar."
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.i = 0
+
+    def error(self, expected):
+        kind, value, pos = self.tokens[self.i]
+        found = "end of input" if kind == "end" else repr(value or kind)
+        raise ParseError(self.text, pos, f"Expected {expected}, found {found}")
+
+    def take(self, kind):
+        "Consumes a token of the given kind, returning its value."
+        tok = self.tokens[self.i]
+        if tok[0] != kind:
+            self.error({"idn": "a name"}.get(kind, repr(kind)))
+        self.i += 1
+        return tok[1]
+
+    def expression(self, names=True, power=0):
+        "Parses operations binding at least as tightly as power."
+        kind, value, pos = self.tokens[self.i]
+        self.i += 1
+
+        if kind == "num" or (kind == "idn" and names):
+            left = value
+        elif kind == "(":
+            left = self.expression(names)
+            self.take(")")
+        else:
+            self.i -= 1
+            self.error("an expression")
+
+        while True:
+            op = self.tokens[self.i][0]
+            if op not in OPS or OPS[op][0] < power:
+                return left
+
+            p, right = OPS[op]
+            self.i += 1
+            left = [left, op, self.expression(names, p if right else p + 1)]
+
+    def names(self):
+        "Parses a parenthesized, comma separated list of names."
+        self.take("(")
+        names = [self.take("idn")]
+        while self.tokens[self.i][0] == ",":
+            self.i += 1
+            names.append(self.take("idn"))
+        self.take(")")
+        return names
+
+    def assignment(self, name):
+        self.take("=")
+        expr = self.expression()
+        self.take(";")
+        return [name, expr]
+
+    def function(self, name):
+        args = self.names()
+        rets = self.names()
+
+        self.take("{")
+        body = [self.assignment(self.take("idn"))]
+        while self.tokens[self.i][0] != "}":
+            body.append(self.assignment(self.take("idn")))
+        self.take("}")
+
+        return {"name": name, "args": args, "rets": rets, "body": body}
+
+    def body(self):
+        "Parses imports, constants and functions until the end."
+        items = []
+
+        while True:
+            kind, value, pos = self.tokens[self.i]
+            if kind == "end" and items:
+                return items
+
+            if kind == "imp":
+                self.i += 1
+                items.append(value)
+            elif kind == "idn":
+                self.i += 1
+                if self.tokens[self.i][0] == "(":
+                    items.append(self.function(value))
+                else:
+                    items.append(self.assignment(value))
+            else:
+                self.error("an import, a constant or a function")
+
+    def file(self):
+        "Parses a whole file: the field, then the body."
+        if self.tokens[self.i][:2] != ("idn", "field"):
+            self.error("'field'")
+        self.i += 1
+
+        limit = self.expression(False)
+        self.take(";")
+        return {"limit": limit, "items": self.body()}
+
+
+def parse(text):
+    "Parses a source file (like ast.WHT)."
+    return Parser(text).file()
+
+
+def parse_body(text):
+    "Parses the body of a module (like ast.BDY)."
+    return Parser(text).body()
+
+
+def parse_file(path):
+    "Parses a source file, given its path."
+    with open(path) as f:
+        return parse(f.read())